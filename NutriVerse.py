@@ -7,10 +7,13 @@ Created on Sat Oct 25 04:08:56 2025
 
 # app.py
 import streamlit as st
-import tempfile
 import os
-from main_coordinator import ProductAnalysisCoordinator
-import ollama
+import time
+from model_manager import get_model_manager
+from llm_scheduler import llm_context
+from session_store import make_session_store
+from semantic_cache import SemanticCache, profile_signature, food_signature
+from intent_detector import detect
 from datetime import datetime
 
 st.set_page_config(page_title="NutriVerse", page_icon="🔍", layout="wide")
@@ -19,57 +22,53 @@ st.title("🔍 NutriVerse")
 st.markdown("Upload product photo, choose preferences → Get risk analysis!")
 
 class EnhancedChatbot:
-    def __init__(self):
+    def __init__(self, embeddings=None):
         self.model_name = "llama3.2:3b"
-        self.user_profiles = {}
-        self.conversation_histories = {}
+        self.models = get_model_manager()
+        # Shared by all Streamlit sessions, and by other app processes when
+        # NUTRIVERSE_SESSION_STORE points at SQLite or Redis
+        self.user_profiles = make_session_store("chatbot_profiles")
+        self.conversation_histories = make_session_store("chatbot_histories")
+        # Reuses answers to near-duplicate questions from users with the same profile
+        self.response_cache = SemanticCache(embeddings.embed_query) if embeddings else None
+    
+    def new_user_profile(self):
+        return {
+            'age': None,
+            'gender': None,
+            'has_children': None,
+            'children_ages': [],
+            'medical_conditions': [],
+            'allergies': [],
+            'dietary_preferences': [],
+            'known_info': [],
+            'conversation_count': 0
+        }
         
     def get_user_profile(self, user_id):
-        if user_id not in self.user_profiles:
-            self.user_profiles[user_id] = {
-                'age': None,
-                'gender': None,
-                'has_children': None,
-                'children_ages': [],
-                'medical_conditions': [],
-                'allergies': [],
-                'dietary_preferences': [],
-                'known_info': set(),
-                'conversation_count': 0
-            }
-        return self.user_profiles[user_id]
+        # A read; edit() would take the lock and write the profile back
+        return self.user_profiles.get(user_id) or self.new_user_profile()
     
     def update_profile(self, user_id, updates):
-        profile = self.get_user_profile(user_id)
-        profile.update(updates)
-        profile['conversation_count'] += 1
+        with self.user_profiles.edit(user_id, self.new_user_profile) as profile:
+            profile.update(updates)
+            profile['conversation_count'] += 1
     
     def extract_profile_info(self, message, user_id):
-        profile = self.get_user_profile(user_id)
-        message_lower = message.lower()
-        age_pattern = r'(\d+)\s*(years?|year|yaş|yaşındayım)'
-        import re
-        age_match = re.search(age_pattern, message_lower)
-        if age_match and not profile['age']:
-            profile['age'] = int(age_match.group(1))
+        signals = detect(message)
         
-        if any(word in message_lower for word in ['baby', 'bebek', 'child', 'çocuk', 'infant', '6-month', '6 month']):
-            if '6-month' in message_lower or '6 month' in message_lower:
+        with self.user_profiles.edit(user_id, self.new_user_profile) as profile:
+            if signals['age'] is not None and not profile['age']:
+                profile['age'] = signals['age']
+            
+            if signals['six_months']:
                 profile['has_children'] = True
                 if 6 not in profile['children_ages']:
                     profile['children_ages'].append(6)
-        
-        medical_keywords = {
-            'diabetes': ['diabet', 'şeker'],
-            'allergy': ['allerg', 'alerj'],
-            'lactose': ['lactose', 'laktoz'],
-            'gluten': ['gluten', 'çölyak'],
-            'heart': ['heart', 'kalp']
-        }
-        
-        for condition, keywords in medical_keywords.items():
-            if any(keyword in message_lower for keyword in keywords) and condition not in profile['medical_conditions']:
-                profile['medical_conditions'].append(condition)
+            
+            for condition in signals['conditions']:
+                if condition not in profile['medical_conditions']:
+                    profile['medical_conditions'].append(condition)
     
     def get_missing_info(self, user_id):
         profile = self.get_user_profile(user_id)
@@ -99,6 +98,19 @@ class EnhancedChatbot:
     
     def generate_personalized_response(self, user_id, message):
         profile = self.get_user_profile(user_id)
+        signals = detect(message)
+        # Questions about different foods or baby ages must not share an answer
+        signature = profile_signature(profile['age'], profile['has_children'], profile['children_ages'],
+                                      profile['medical_conditions'], profile['allergies'],
+                                      food_signature(message, signals['ingredients']), signals['baby_age'])
+        question_vector = None
+        if self.response_cache:
+            try:
+                cached, question_vector = self.response_cache.lookup(message, signature)
+                if cached:
+                    return cached
+            except Exception as e:
+                print(f"Response cache unavailable: {str(e)}")
         
         # Enhanced prompt with user context
         prompt = f"""
@@ -125,29 +137,32 @@ class EnhancedChatbot:
         """
         
         try:
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[{'role': 'user', 'content': prompt}],
-                options={'temperature': 0.3, 'num_predict': 500}
-            )
-            return response['message']['content'].strip()
+            with llm_context('chat', user_id):
+                response = self.models.chat(
+                    self.model_name,
+                    messages=[{'role': 'user', 'content': prompt}],
+                    options={'temperature': 0.3, 'num_predict': 500}
+                )
+            answer = response['message']['content'].strip()
+            if question_vector is not None:
+                self.response_cache.store(message, signature, answer, question_vector)
+            return answer
         except Exception as e:
             return f"I apologize, but I'm having trouble responding right now. Please try again. Error: {str(e)}"
     
     def get_conversation_history(self, user_id, max_messages=5):
-        if user_id not in self.conversation_histories:
+        history = self.conversation_histories.get(user_id)
+        if history is None:
             return "No previous conversation"
-        history = self.conversation_histories[user_id][-max_messages:]
-        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in history[-max_messages:]])
     
     def add_to_history(self, user_id, role, content):
-        if user_id not in self.conversation_histories:
-            self.conversation_histories[user_id] = []
-        self.conversation_histories[user_id].append({
-            'role': role,
-            'content': content,
-            'timestamp': datetime.now().isoformat()
-        })
+        with self.conversation_histories.edit(user_id, list) as history:
+            history.append({
+                'role': role,
+                'content': content,
+                'timestamp': datetime.now().isoformat()
+            })
     
     def chat(self, user_id, message):
         # Extract profile information from message
@@ -168,11 +183,80 @@ class EnhancedChatbot:
 
 @st.cache_resource
 def initialize_agents():
+    # With an API service running (api_service.py) this page is only a client of it
+    if os.environ.get("NUTRIVERSE_API_URL"):
+        from api_client import NutriVerseClient
+        client = NutriVerseClient()
+        return client, client, client
+    from main_coordinator import ProductAnalysisCoordinator
+    from job_queue import JobQueue
     coordinator = ProductAnalysisCoordinator()
-    chatbot = EnhancedChatbot()
-    return coordinator, chatbot
+    chatbot = EnhancedChatbot(embeddings=coordinator.rag_agent.embeddings)
+    return coordinator, chatbot, JobQueue(coordinator)
+
+coordinator, chatbot, job_queue = initialize_agents()
+
+
+def show_result(result, retry=None):
+    failed_diets = result.get('failed_diets', [])
+    if failed_diets:
+        st.warning(f"⚠️ Analysis failed for: {', '.join(failed_diets)}. The score below leaves them out.")
+        if retry and st.button("🔁 Retry analysis"):
+            retry()
+    else:
+        st.success("✅ Analysis completed!")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader(" Product Information")
+        st.write(f"**Brand:** {result['brand']}")
+        st.write(f"**Product Name:** {result['product_name']}")
+        st.write(f"**Ingredients:** {result['ingredients'][:300]}...")
+
+    with col2:
+        st.subheader("Risk Analysis")
+        risk_score = result['risk_score']
+        st.metric("Safety Score", f"{risk_score:.1f}%")
+        st.write(f"**Overall Status:** {result['overall_safety']}")
+
+    st.subheader(" Detailed Risk Analysis")
+
+    for preference, analysis in result['risk_analysis'].items():
+        col1, col2, col3 = st.columns([1, 2, 1])
+
+        with col1:
+            if analysis.get('error'):
+                st.warning("⚠️ ANALYSIS FAILED")
+            elif analysis['suitable']:
+                st.success("✅ SUITABLE")
+            else:
+                st.error("❌ RISKY")
+
+        with col2:
+            description = analysis.get('explanation', 'No explanation available')
+            st.write(f"**{preference.upper()}** - {description}")
+
+            if analysis['suitable'] is False:
+                hazardous_ingredients = analysis.get('hazardous_ingredients', [])
+                if hazardous_ingredients:
+                    st.write(f"Hazardous ingredients: {', '.join(hazardous_ingredients)}")
+
+        with col3:
+            risk_level = analysis.get('risk_level', 'UNKNOWN')
+            st.write(f"Risk: {risk_level}")
+
+    st.subheader(" Recommendations")
+    if len(failed_diets) == len(result['risk_analysis']):
+        st.warning("The analysis could not be completed. Please retry.")
+    elif risk_score > 80:
+        st.info("This product appears suitable for your preferences!")
+    elif risk_score > 50:
+        st.warning(" Consume this product carefully. There might be some risks.")
+    else:
+        st.error("This product is not suitable for your preferences!")
+
 
-coordinator, chatbot = initialize_agents()
 tab1, tab2 = st.tabs(["📊 Product Analysis", "💬 Health Assistant"])
 
 with tab1:
@@ -186,73 +270,34 @@ with tab1:
     uploaded_file = st.file_uploader("Upload product photo", type=['jpg', 'jpeg', 'png'])
 
     if uploaded_file and user_preferences:
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            image_path = tmp_file.name
-        
-        try:
-            if st.button("🔍 Analyze Product", type="primary"):
-                with st.spinner("3-agent system analyzing..."):
-                    result = coordinator.full_analysis(image_path, user_preferences)
-                
-                if "error" in result:
-                    st.error(f"❌ Error: {result['error']}")
-                else:
-                    st.success("✅ Analysis completed!")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.subheader(" Product Information")
-                        st.write(f"**Brand:** {result['brand']}")
-                        st.write(f"**Product Name:** {result['product_name']}")
-                        st.write(f"**Ingredients:** {result['ingredients'][:300]}...")
-                    
-                    with col2:
-                        st.subheader("Risk Analysis")
-                        risk_score = result['risk_score']
-                        st.metric("Safety Score", f"{risk_score:.1f}%")
-                        st.write(f"**Overall Status:** {result['overall_safety']}")
-                    
-                    st.subheader(" Detailed Risk Analysis")
-                    
-                    for preference, analysis in result['risk_analysis'].items():
-                        col1, col2, col3 = st.columns([1, 2, 1])
-                        
-                        with col1:
-                            if analysis['suitable']:
-                                st.success("✅ SUITABLE")
-                            else:
-                                st.error("❌ RISKY")
-                        
-                        with col2:
-                            description = analysis.get('explanation', 'No explanation available')
-                            st.write(f"**{preference.upper()}** - {description}")
-                            
-                            if not analysis['suitable']:
-                                hazardous_ingredients = analysis.get('hazardous_ingredients', [])
-                                if hazardous_ingredients:
-                                    st.write(f"Hazardous ingredients: {', '.join(hazardous_ingredients)}")
-                        
-                        with col3:
-                            risk_level = analysis.get('risk_level', 'UNKNOWN')
-                            st.write(f"Risk: {risk_level}")
-                    
-                    st.subheader(" Recommendations")
-                    if risk_score > 80:
-                        st.info("This product appears suitable for your preferences!")
-                    elif risk_score > 50:
-                        st.warning(" Consume this product carefully. There might be some risks.")
-                    else:
-                        st.error("This product is not suitable for your preferences!")
-                        
-        finally:
-            os.unlink(image_path)
-
+        if st.button("🔍 Analyze Product", type="primary"):
+            # Runs in the job queue workers, so a rerun or closed tab does not lose the analysis
+            try:
+                st.session_state.job_id = job_queue.submit(uploaded_file.getvalue(), user_preferences)
+            except Exception as e:
+                st.error(f"❌ Error: {str(e)}")
     elif uploaded_file and not user_preferences:
         st.warning("Please select allergen/diet preferences")
 
+    job = job_queue.get_job(st.session_state.job_id) if st.session_state.get('job_id') else None
+    poll_job = job is not None and job['status'] in ('queued', 'running')
+    if poll_job:
+        stages = job['progress']['stages']
+        diets = job['progress']['diets']
+        finished = sum(state == 'done' for state in stages.values()) + sum(state == 'done' for state in diets.values())
+        st.progress(finished / (len(stages) + len(diets)),
+                    text="Waiting in queue..." if job['status'] == 'queued' else f"3-agent system analyzing: {job['stage']}")
+        st.write(" · ".join(f"{stage}: {state}" for stage, state in stages.items()))
+        st.write(" · ".join(f"{diet}: {state}" for diet, state in diets.items()))
+    elif job and job['status'] == 'failed':
+        st.error(f"❌ Error: {job['error']}")
+    elif job:
+        def retry_analysis():
+            # Re-queues the same job; only an incomplete result is run again
+            st.session_state.job_id = job_queue.submit(uploaded_file.getvalue(), job['preferences'])
+            st.rerun()
+        show_result(job['result'], retry=retry_analysis if uploaded_file else None)
+
 with tab2:
     st.header("💬 Interactive Health Assistant")
     st.markdown("Ask me anything about nutrition, baby care, or product safety!")
@@ -333,4 +378,9 @@ st.sidebar.info("""
 - Baby and child safety advice
 - Dietary recommendations
 - Interactive Q&A
-""")
\ No newline at end of file
+""")
+
+# Poll after the whole page, including the chat tab, has rendered
+if poll_job:
+    time.sleep(1)
+    st.rerun()
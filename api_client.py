@@ -0,0 +1,62 @@
+# api_client.py
+# Used by NutriVerse.py in place of the in-process agents when NUTRIVERSE_API_URL is set.
+import os
+import requests
+
+
+class NutriVerseClient:
+    def __init__(self, base_url=None, timeout=300):
+        self.base_url = (base_url or os.environ["NUTRIVERSE_API_URL"]).rstrip("/")
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        if response.status_code == 503:
+            return {"error": response.json().get('detail', "Server busy")}
+        response.raise_for_status()
+        return response.json()
+
+    def full_analysis(self, image_path, user_preferences, user_id=None):
+        try:
+            with open(image_path, 'rb') as f:
+                return self.request("POST", "/analyze", files={'image': (os.path.basename(image_path), f)},
+                                    data={'preferences': ",".join(user_preferences), 'user_id': user_id or ""})
+        except Exception as e:
+            return {"error": f"API hatası: {str(e)}"}
+
+    def submit(self, image_bytes, user_preferences):
+        result = self.request("POST", "/jobs", files={'image': ("image.jpg", image_bytes)},
+                              data={'preferences': ",".join(user_preferences)})
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        return result['job_id']
+
+    def get_job(self, job_id):
+        try:
+            return self.request("GET", f"/jobs/{job_id}")
+        except Exception as e:
+            return {'status': 'failed', 'error': f"API hatası: {str(e)}"}
+
+    def chat(self, user_id, message):
+        try:
+            result = self.request("POST", "/chat", json={'user_id': user_id, 'message': message})
+            return result.get('response') or result.get('error')
+        except Exception as e:
+            return f"I apologize, but I'm having trouble responding right now. Please try again. Error: {str(e)}"
+
+    def get_user_profile(self, user_id):
+        # Maps the MemoryAgent profile onto the fields the Streamlit sidebar shows
+        try:
+            profile = self.request("GET", f"/profile/{user_id}")
+        except Exception:
+            profile = {}
+        baby_age = profile.get('baby_age_months')
+        return {
+            'age': profile.get('age_group'),
+            'has_children': profile.get('has_children'),
+            'children_ages': [f"{baby_age} months"] if baby_age is not None else [],
+            'medical_conditions': profile.get('medical_conditions', []),
+            'allergies': profile.get('allergies', []),
+            'conversation_count': profile.get('chat_interactions', 0)
+        }
@@ -0,0 +1,205 @@
+# api_service.py
+# HTTP API over the agents, so scans and chat can be served to any client and the
+# Streamlit page only renders results.
+#
+#   WEB_CONCURRENCY=4 NUTRIVERSE_SESSION_STORE=sqlite:///nutriverse_sessions.db \
+#       uvicorn api_service:app --host 0.0.0.0 --port 8000
+#   NUTRIVERSE_API_URL=http://localhost:8000 streamlit run NutriVerse.py
+#
+# Every worker process loads its own agents; put several Ollama hosts behind
+# OLLAMA_HOSTS (llm_router.py) when running more than one worker. Chat history, profiles
+# and summaries must then live in a shared session store (sqlite or redis), or each
+# worker sees a different part of every user's state.
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from singleflight import coalescing_stats
+from llm_scheduler import llm_context
+from session_store import is_process_local
+
+
+class BoundedScheduler:
+    """Runs blocking agent calls off the event loop: `limit` at once, `queue_size` waiting, the rest get 503"""
+
+    def __init__(self, name, limit, queue_size, executor):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(limit)
+        self.queue_size = queue_size
+        self.executor = executor
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail=f"Too many {self.name} requests, please retry")
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # run_in_executor does not carry contextvars (the LLM priority) into the thread
+            call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+            return await loop.run_in_executor(self.executor, call)
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    def get_stats(self):
+        return {'running': self.running, 'waiting': self.waiting, 'rejected': self.rejected}
+
+
+agents = {}
+schedulers = {}
+# Striped so the lock table stays the same size however many users there are
+user_locks = [asyncio.Lock() for _ in range(256)]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    from main_coordinator import ProductAnalysisCoordinator
+    from memory_agent import MemoryAgent
+    from chatbot_agent import ChatbotAgent
+    from job_queue import JobQueue
+
+    coordinator = ProductAnalysisCoordinator(hazard_matrix_path=os.environ.get("NUTRIVERSE_HAZARD_MATRIX"))
+    memory_agent = MemoryAgent()
+    agents['coordinator'] = coordinator
+    agents['memory'] = memory_agent
+    agents['jobs'] = JobQueue(coordinator, db_path=os.environ.get("NUTRIVERSE_JOBS_DB", "nutriverse_jobs.db"))
+    agents['chatbot'] = ChatbotAgent(coordinator.rag_agent, memory_agent, coordinator.vision_agent,
+                                     model_manager=coordinator.model_manager)
+    # uvicorn --workers starts this app in child processes
+    several_workers = (int(os.environ.get("WEB_CONCURRENCY", "1")) > 1
+                       or multiprocessing.parent_process() is not None)
+    if several_workers and is_process_local():
+        print("WARNING: session state is in-memory but the API may run in several worker processes; "
+              "set NUTRIVERSE_SESSION_STORE=sqlite:///nutriverse_sessions.db or redis://... "
+              "so every worker sees the same chat history, profile and cache")
+
+    executor = ThreadPoolExecutor(max_workers=int(os.environ.get("NUTRIVERSE_API_THREADS", "16")),
+                                  thread_name_prefix="api")
+    schedulers['analyze'] = BoundedScheduler("analysis", int(os.environ.get("NUTRIVERSE_MAX_ANALYSES", "4")),
+                                             int(os.environ.get("NUTRIVERSE_ANALYSIS_QUEUE", "32")), executor)
+    schedulers['chat'] = BoundedScheduler("chat", int(os.environ.get("NUTRIVERSE_MAX_CHATS", "8")),
+                                          int(os.environ.get("NUTRIVERSE_CHAT_QUEUE", "64")), executor)
+    yield
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="NutriVerse API", lifespan=lifespan)
+
+
+def user_lock(user_id):
+    # Messages of one user are answered in order within this worker; across workers the
+    # shared session store keeps each update atomic, but clients should send one at a time
+    return user_locks[zlib.crc32(str(user_id).encode()) % len(user_locks)]
+
+
+class ChatRequest(BaseModel):
+    user_id: str
+    message: str
+
+
+@app.get("/health")
+async def health():
+    return {'status': 'ok', 'models': agents['coordinator'].model_manager.get_stats()}
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        'schedulers': {name: scheduler.get_stats() for name, scheduler in schedulers.items()},
+        'coalescing': coalescing_stats(),
+        'jobs': agents['jobs'].get_stats(),
+        'response_cache': agents['chatbot'].response_cache.get_stats(),
+        'label_reading': agents['coordinator'].vision_agent.get_stats(),
+        'structured_output': agents['coordinator'].rag_agent.get_format_stats(),
+        'models': agents['coordinator'].model_manager.get_stats(),
+        'llm_queue': agents['coordinator'].model_manager.scheduler.get_stats()
+    }
+
+
+@app.post("/analyze")
+async def analyze(image: UploadFile = File(...), preferences: str = Form(...), user_id: str = Form(None)):
+    user_preferences = [p.strip() for p in preferences.split(",") if p.strip()]
+    if not user_preferences:
+        raise HTTPException(status_code=400, detail="Select at least one diet preference")
+
+    suffix = os.path.splitext(image.filename or "")[1] or ".jpg"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(await image.read())
+        image_path = tmp_file.name
+    try:
+        with llm_context('scan', user_id):
+            result = await schedulers['analyze'].run(agents['coordinator'].full_analysis, image_path, user_preferences)
+    finally:
+        os.unlink(image_path)
+
+    if user_id and "error" not in result:
+        await run_in_threadpool(agents['memory'].add_product_analysis, user_id, result)
+    return result
+
+
+@app.post("/jobs")
+async def submit_job(image: UploadFile = File(...), preferences: str = Form(...)):
+    user_preferences = [p.strip() for p in preferences.split(",") if p.strip()]
+    if not user_preferences:
+        raise HTTPException(status_code=400, detail="Select at least one diet preference")
+    image_bytes = await image.read()
+    return {'job_id': await run_in_threadpool(agents['jobs'].submit, image_bytes, user_preferences)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(agents['jobs'].get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    async with user_lock(request.user_id):
+        answer = await schedulers['chat'].run(agents['chatbot'].chat, request.user_id, request.message)
+    return {'response': answer}
+
+
+@app.post("/chat/image")
+async def chat_with_image(user_id: str = Form(...), message: str = Form(...), image: UploadFile = File(...)):
+    suffix = os.path.splitext(image.filename or "")[1] or ".jpg"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(await image.read())
+        image_path = tmp_file.name
+    try:
+        async with user_lock(user_id):
+            answer = await schedulers['chat'].run(agents['chatbot'].chat, user_id, message, image_path)
+    finally:
+        os.unlink(image_path)
+    return {'response': answer}
+
+
+@app.get("/profile/{user_id}")
+async def get_profile(user_id: str):
+    # Polled by the UI on every rerun, so it must not count as activity
+    return await run_in_threadpool(agents['memory'].get_user_profile, user_id)
+
+
+@app.put("/profile/{user_id}")
+async def update_profile(user_id: str, updates: dict):
+    async with user_lock(user_id):
+        await run_in_threadpool(agents['memory'].update_user_profile, user_id, updates)
+    return await run_in_threadpool(agents['memory'].get_user_profile, user_id)
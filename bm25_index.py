@@ -0,0 +1,61 @@
+# bm25_index.py
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# "E 471", "E-471" and "e471" all become the single token "e471"
+E_NUMBER_PATTERN = re.compile(r"\be[\s-]?(\d{3,4}[a-z]?)\b")
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+             'of', 'on', 'or', 'that', 'the', 'to', 'with'}
+
+
+def tokenize(text):
+    text = E_NUMBER_PATTERN.sub(r"e\1", text.lower())
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index scored with Okapi BM25; only postings of query terms are visited"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        self.idf = {}
+        self.avg_length = 0.0
+
+    def add_documents(self, texts):
+        for text in texts:
+            doc_id = len(self.doc_lengths)
+            tokens = tokenize(text)
+            self.doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((doc_id, tf))
+        n = len(self.doc_lengths)
+        self.avg_length = sum(self.doc_lengths) / n if n else 0.0
+        self.idf = {term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for term, docs in self.postings.items()}
+
+    def search(self, query, k=10):
+        """Returns [(doc_id, score)] best first"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several ranked lists of doc ids into [(doc_id, score)] best first"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
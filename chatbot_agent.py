@@ -6,18 +6,107 @@ Created on Sat Oct 25 17:19:59 2025
 """
 
 # chatbot_agent.py (English version - UPDATED)
-import ollama
-import re
+import contextvars
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from chatbot_tools import ChatbotTools, TOOL_SPECS
+from intent_detector import detect
+from model_manager import get_model_manager
+from llm_scheduler import llm_context
+from session_store import make_session_store
+from semantic_cache import SemanticCache, profile_signature, food_signature
+from prompt_builder import (PromptBuilder, CHAT_TOKENIZER, compact_profile, compact_insights,
+                            compact_similar_users, compact_tool_results)
+
+class TurnContext:
+    """Memoizes every agent lookup made while answering one chat message"""
+    def __init__(self, agent, user_id, message, image_path=None):
+        self.agent = agent
+        self.user_id = user_id
+        self.message = message
+        self.image_path = image_path
+        self.cache = {}
+        # Tools of the turn run on several threads
+        self.lock = threading.RLock()
+    
+    @property
+    def signals(self):
+        # One pass over the message serves every routing decision of the turn
+        return detect(self.message)
+    
+    def get(self, key, compute):
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = compute()
+            return self.cache[key]
+    
+    @property
+    def user_profile(self):
+        return self.get('user_profile', lambda: self.agent.tools.get_user_profile(self.user_id))
+    
+    @property
+    def segment(self):
+        # Read live: symptom detection may re-segment the user during the turn
+        return self.user_profile.get('segment', 'general_health')
+    
+    @property
+    def problem_type(self):
+        return self.signals['problem_type']
+    
+    @property
+    def prompt_type(self):
+        return self.signals['prompt_type']
+    
+    @property
+    def ingredients(self):
+        # Set by the image tool when the user sent a photo of the label
+        return self.get('ingredients', lambda: self.signals['ingredients'])
+    
+    @property
+    def community_insights(self):
+        return self.get('community_insights', lambda: self.agent.memory_agent.get_community_insights(
+            self.segment, self.problem_type))
+    
+    @property
+    def rag_context(self):
+        return self.get('rag_context', lambda: self.agent.get_rag_context(self.message, self.user_profile))
+    
+    def similar_users(self, max_users=5):
+        # Fetch the largest list once; the ranking is the same for any prefix
+        users = self.get('similar_users', lambda: self.agent.memory_agent.get_similar_users(self.user_id, 5))
+        return users[:max_users]
 
 class ChatbotAgent:
-    def __init__(self, rag_agent, memory_agent, vision_agent):
+    def __init__(self, rag_agent, memory_agent, vision_agent, model_manager=None):
         self.rag_agent = rag_agent
         self.memory_agent = memory_agent
         self.vision_agent = vision_agent
         self.tools = ChatbotTools(rag_agent, memory_agent, vision_agent)
         self.model_name = "llama3.2:3b"
-        self.conversation_histories = {}
+        self.models = model_manager or get_model_manager()
+        self.conversation_histories = make_session_store("chat_histories")
+        # Older turns are folded into a running summary so prompts stay the same size
+        self.conversation_summaries = make_session_store("chat_summaries")
+        self.summary_threshold = 12
+        self.recent_messages = 6
+        self.max_history = 20
+        self.max_overflow = 100
+        self.summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+        self.summarizing = set()
+        self.summarizing_lock = threading.Lock()
+        # Shared by all turns; LLM-bound tools of one turn run side by side
+        self.tool_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-tool")
+        # Near-duplicate questions from users with the same profile signature reuse the answer
+        self.response_cache = SemanticCache(lambda question: self.rag_agent.embeddings.embed_query(question))
+        self.prompt_builder = PromptBuilder(tokenizer_name=CHAT_TOKENIZER)
+        # Sections in order of relevance for each prompt type; lower ones are truncated first
+        self.section_priorities = {
+            "health_advice": ['profile', 'tools', 'rag_context', 'history', 'community_insights'],
+            "product_analysis": ['tools', 'rag_context', 'community_insights'],
+            "symptom_analysis": ['profile', 'similar_users', 'community_insights']
+        }
         self.cot_prompts = {
             "health_advice_with_tools": """
             You are a health and nutrition expert. Analyze the user's question and use available tools to provide personalized advice.
@@ -101,19 +190,13 @@ class ChatbotAgent:
             """
         }
     
-    def get_enhanced_context(self, user_id, question):
-        user_profile = self.tools.get_user_profile(user_id)
-        segment = user_profile.get('segment', 'general_health')
-        rag_context = self.get_rag_context(question, user_profile)
-        community_insights = self.memory_agent.get_community_insights(segment, self.extract_problem_type(question))
-        similar_users = self.memory_agent.get_similar_users(user_id, 3)
-        
+    def get_enhanced_context(self, turn):
         return {
-            'rag_context': rag_context,
-            'community_insights': community_insights,
-            'similar_users': similar_users,
-            'segment': segment,
-            'user_profile': user_profile
+            'rag_context': turn.rag_context,
+            'community_insights': turn.community_insights,
+            'similar_users': turn.similar_users(3),
+            'segment': turn.segment,
+            'user_profile': turn.user_profile
         }
     
     def get_rag_context(self, question, user_profile):
@@ -124,157 +207,118 @@ class ChatbotAgent:
                 keywords.extend(user_profile.get('medical_conditions', []))
                 keywords.extend(user_profile.get('allergies', []))
             
-            context = ""
-            for keyword in set(keywords[:4]):
-                try:
-                    docs=self.rag_agent.vector_store.similarity_search(keyword, k=2)
-                    for doc in docs:
-                        context+= f"\n{keyword.upper()} KNOWLEDGE: {doc.page_content}\n"
-                except:
-                    continue
-            
-            return context[:1200]
+            keywords = list(dict.fromkeys(keywords[:4]))
+            results = self.rag_agent.batch_similarity_search(keywords, k=2)
+            # Ranked best match first; budgeting happens in the prompt builder
+            return "\n".join([f"{r['query'].upper()} KNOWLEDGE: {r['content']}" for r in results])
         except Exception as e:
             return f"RAG context error: {str(e)}"
     
-    def detect_tool_requirements(self, message, user_profile):
+    def detect_tool_requirements(self, turn):
         """Detect which tools are needed based on message content"""
-        required_tools =[]
-        message_lower = message.lower()
-        
-        # Enhanced tool detection with segmentation
-        if any(word in message_lower for word in ['similar','other', 'another', 'same', 'else']):
-            required_tools.append("find_similar_users")
-        
-        if any(word in message_lower for word in ['ingredient', 'content', 'material', 'contains']):
-            required_tools.append("analyze_ingredients")
-        
-        if any(word in message_lower for word in ['photo', 'image', 'picture']):
-            required_tools.append("extract_ingredients_from_image")
-        
-        if any(word in message_lower for word in ['baby', 'child', 'infant', 'toddler']):
-            required_tools.append("check_baby_safety")
-            required_tools.append("get_age_specific_advice")
-        
-        if any(word in message_lower for word in ['risk', 'safe', 'dangerous', 'healthy']):
-            required_tools.append("calculate_nutrition_risk")
+        signals = turn.signals
+        required_tools = list(signals['tools'])
         
         # Symptom detection
-        if any(word in message_lower for word in ['bloating', 'pain', 'hurt', 'symptom', 'feel bad']):
-            required_tools.append("find_similar_users")
+        if signals['symptom']:
             # Update user profile with reported symptom
             self.memory_agent.update_from_chat_interaction(
-                user_profile.get('user_id', 'unknown'), 
+                turn.user_id, 
                 "symptom_report", 
                 "neutral"
             )
+            # Re-read so the rest of the turn sees the new segment with any store backend
+            turn.cache.pop('user_profile', None)
         
         # Always include user profile for personalization
         required_tools.append("get_user_profile")
         
-        return list(set(required_tools))
+        return list(dict.fromkeys(required_tools))
     
-    def execute_tools(self, user_id, required_tools, message):
-        """Execute required tools and collect results"""
-        tool_results = {}
-        user_profile = self.tools.get_user_profile(user_id)
+    def execute_tools(self, turn, required_tools):
+        """Execute required tools and collect results; independent tools run concurrently"""
+        runs = {tool: TOOL_SPECS.get(tool, {}).get('same_as', tool) for tool in required_tools}
+        pending = set(runs.values())
+        results = {}
         
-        for tool in required_tools:
-            try:
-                if tool == "get_user_profile":
-                    tool_results[tool] = user_profile
-                
-                elif tool == "find_similar_users":
-                    similar_users = self.memory_agent.get_similar_users(user_id, 5)
-                    tool_results[tool] = {
-                        "similar_users_count": len(similar_users),
-                        "users": similar_users[:3],  # Top 3 most similar
-                        "common_solutions": self.extract_common_solutions(similar_users)
-                    }
-                
-                elif tool == "analyze_ingredients":
-                    ingredients = self.extract_ingredients_from_text(message)
-                    if ingredients:
-                        tool_results[tool] = self.tools.analyze_ingredients(ingredients, user_profile)
-                
-                elif tool == "extract_ingredients_from_image":
-                    tool_results[tool] = {"message": "Image analysis requires uploaded image"}
-                
-                elif tool == "calculate_nutrition_risk":
-                    ingredients = self.extract_ingredients_from_text(message)
-                    if ingredients:
-                        tool_results[tool] = self.tools.calculate_nutrition_risk(ingredients, user_profile)
-                
-                elif tool == "get_age_specific_advice":
-                    tool_results[tool] = self.tools.get_age_specific_advice(
-                        user_profile.get('age_group', 'general'), 
-                        self.extract_product_type(message)
-                    )
-                
-                elif tool == "check_baby_safety":
-                    if user_profile.get('has_children'):
-                        ingredients = self.extract_ingredients_from_text(message)
-                        baby_age = self.extract_baby_age(message)
-                        if ingredients and baby_age:
-                            tool_results[tool] = self.tools.check_baby_safety(ingredients, baby_age)
-                
-            except Exception as e:
-                tool_results[tool] = f"Tool error: {str(e)}"
+        while pending:
+            ready = [tool for tool in pending
+                     if not any(dep in pending for dep in TOOL_SPECS.get(tool, {}).get('depends_on', []))]
+            pending.difference_update(ready)
+            # Executor threads do not inherit contextvars (the chat LLM priority)
+            futures = {tool: self.tool_executor.submit(contextvars.copy_context().run, self.run_tool, turn, tool)
+                       for tool in ready if TOOL_SPECS.get(tool, {}).get('cost') == 'llm'}
+            for tool in ready:
+                if tool not in futures:
+                    results[tool] = self.run_tool(turn, tool)
+            wait(futures.values())
+            for tool, future in futures.items():
+                results[tool] = future.result()
         
-        return tool_results
+        return {tool: results[run] for tool, run in runs.items() if results.get(run) is not None}
     
-    def extract_ingredients_from_text(self, text):
-        ingredient_keywords = ['ingredients', 'contains', 'made with', 'composition', 'made from']
-        for keyword in ingredient_keywords:
-            if keyword in text.lower():
-                start_idx = text.lower().find(keyword) + len(keyword)
-                return text[start_idx:start_idx+200]
+    def run_tool(self, turn, tool):
+        """Result of one tool, or None when it has nothing to add for this message"""
+        user_profile = turn.user_profile
+        try:
+            if tool == "get_user_profile":
+                return user_profile
+            
+            elif tool == "find_similar_users":
+                similar_users = turn.similar_users(5)
+                return {
+                    "similar_users_count": len(similar_users),
+                    "users": similar_users[:3],  # Top 3 most similar
+                    "common_solutions": self.extract_common_solutions(similar_users)
+                }
+            
+            elif tool == "analyze_ingredients":
+                ingredients = turn.ingredients
+                if ingredients:
+                    return self.tools.analyze_ingredients(ingredients, user_profile)
+            
+            elif tool == "extract_ingredients_from_image":
+                if not turn.image_path:
+                    return {"message": "Image analysis requires uploaded image"}
+                result = self.tools.extract_ingredients_from_image(turn.image_path)
+                if result.get('success'):
+                    # The label text replaces any ingredients typed in the message
+                    with turn.lock:
+                        turn.cache['ingredients'] = result['ingredients']
+                return result
+            
+            elif tool == "get_age_specific_advice":
+                return self.tools.get_age_specific_advice(
+                    user_profile.get('age_group', 'general'), 
+                    turn.signals['product_type']
+                )
+            
+            elif tool == "check_baby_safety":
+                if user_profile.get('has_children'):
+                    ingredients = turn.ingredients
+                    baby_age = turn.signals['baby_age']
+                    if ingredients and baby_age:
+                        return self.tools.check_baby_safety(ingredients, baby_age)
+            
+        except Exception as e:
+            return f"Tool error: {str(e)}"
         return None
     
+    def extract_ingredients_from_text(self, text):
+        return detect(text)['ingredients']
+    
     def extract_keywords(self, text):
-        health_keywords = [
-            'diabetes', 'sugar', 'heart', 'blood pressure', 'allergy', 'diet', 
-            'nutrition', 'vitamin', 'mineral', 'protein', 'fat', 'carbohydrate',
-            'baby', 'child', 'pregnant', 'elderly', 'sport', 'exercise',
-            'medicine', 'treatment', 'symptom', 'diagnosis', 'cholesterol', 'obesity',
-            'celiac', 'gluten', 'lactose', 'vegan', 'vegetarian', 'bloating', 'pain'
-        ]
-        
-        found_keywords = []
-        text_lower = text.lower()
-        
-        for keyword in health_keywords:
-            if keyword in text_lower:
-                found_keywords.append(keyword)
-        
-        return found_keywords if found_keywords else ['general health']
+        # A copy: callers extend it with profile conditions
+        return list(detect(text)['keywords'])
     
     def extract_problem_type(self, text):
-        text_lower = text.lower()
-        if any(word in text_lower for word in ['baby', 'infant', 'child']):
-            return "child_health"
-        elif any(word in text_lower for word in ['bloating', 'stomach', 'digest']):
-            return "digestive_issues"
-        elif any(word in text_lower for word in ['sugar', 'diabet']):
-            return "diabetes"
-        elif any(word in text_lower for word in ['heart', 'blood pressure']):
-            return "heart_health"
-        else:
-            return "general_health"
+        return detect(text)['problem_type']
     
     def extract_product_type(self, text):
-        product_types = ['formula', 'cereal', 'yogurt', 'milk', 'cheese', 'bread', 'drink', 'snack', 'baby food']
-        for p_type in product_types:
-            if p_type in text.lower():
-                return p_type
-        return "general"
+        return detect(text)['product_type']
     
     def extract_baby_age(self, text):
-        age_pattern = r'(\d+)\s*(month|months|monthly|mo)'
-        match = re.search(age_pattern, text)
-        if match:
-            return int(match.group(1))
-        return 6  # Default age
+        return detect(text)['baby_age']
     
     def extract_common_solutions(self, similar_users):
         all_solutions = []
@@ -289,65 +333,80 @@ class ChatbotAgent:
         common = Counter([s for s in all_solutions if s]).most_common(3)
         return [solution for solution, count in common]
     
-    def generate_enhanced_prompt(self, user_id, question, tool_results):
-        history = self.get_conversation_history(user_id)
-        history_text = "\n".join([f"{msg['role']}: {msg['message']}" for msg in history])
-        context = self.get_enhanced_context(user_id, question)
-        prompt_type = self.determine_prompt_type(question)
+    def generate_enhanced_prompt(self, turn, tool_results):
+        question = turn.message
+        history = self.get_conversation_history(turn.user_id, max_messages=self.recent_messages)
+        summary = self.conversation_summaries.get(turn.user_id, {}).get('summary')
+        context = self.get_enhanced_context(turn)
+        prompt_type = turn.prompt_type
         base_prompt = self.cot_prompts.get(prompt_type + "_with_tools", self.cot_prompts["health_advice_with_tools"])
-        tools_text = "\n".join([f"{tool}: {result}" for tool, result in tool_results.items()])
         
-        if prompt_type == "health_advice":
-            return base_prompt.format(
-                question=question,
-                profile=context['user_profile'],
-                segment=context['segment'],
-                history=history_text,
-                tools=tools_text,
-                rag_context=context['rag_context'],
-                community_insights=context['community_insights']
-            )
-        elif prompt_type == "symptom_analysis":
-            return base_prompt.format(
-                question=question,
-                profile=context['user_profile'],
-                segment=context['segment'],
-                similar_users=context['similar_users'],
-                community_insights=context['community_insights']
-            )
-        else:
-            return base_prompt.format(
-                question=question,
-                product_info=question,
-                segment=context['segment'],
-                tools=tools_text,
-                rag_context=context['rag_context'],
-                community_insights=context['community_insights']
-            )
+        fixed = {
+            'question': question,
+            'product_info': question,
+            'segment': context['segment']
+        }
+        sections = {
+            'profile': compact_profile(context['user_profile']),
+            'history': (f"Earlier in this conversation: {summary}\n" if summary else "") +
+                       "\n".join([f"{msg['role']}: {msg['message']}" for msg in history]),
+            'tools': compact_tool_results(self.unique_tool_results(tool_results)),
+            'rag_context': context['rag_context'],
+            'community_insights': compact_insights(context['community_insights']),
+            'similar_users': compact_similar_users(context['similar_users'])
+        }
+        return self.prompt_builder.build(base_prompt, fixed, sections, self.section_priorities[prompt_type])
+    
+    def unique_tool_results(self, tool_results):
+        """Tools merged through same_as share one result object; it goes into the prompt once"""
+        unique = {}
+        for tool, result in tool_results.items():
+            merged_into = TOOL_SPECS.get(tool, {}).get('same_as')
+            if merged_into in tool_results and tool_results[merged_into] is result:
+                continue
+            unique[tool] = result
+        return unique
+    
+    def get_prompt_stats(self):
+        """Token breakdown per section of the last prompt"""
+        return self.prompt_builder.get_breakdown()
     
     def chat(self, user_id, message, image_path=None):
+        # Chat turns are served before scans and batch work when Ollama is busy
+        with llm_context('chat', user_id):
+            return self.answer(user_id, message, image_path)
+    
+    def answer(self, user_id, message, image_path=None):
         self.add_to_history(user_id, "user", message)
-        self.memory_agent.get_or_create_user_profile(user_id)
-
-        user_profile = self.tools.get_user_profile(user_id)
-        required_tools = self.detect_tool_requirements(message, user_profile)
+        turn = TurnContext(self, user_id, message, image_path)
+        required_tools = self.detect_tool_requirements(turn)
+        
+        # Routing above may re-segment the user, so the signature is taken after it
+        cached, signature, question_vector = None, None, None
+        if not image_path:
+            signature = self.cache_signature(turn)
+            try:
+                cached, question_vector = self.response_cache.lookup(message, signature)
+            except Exception as e:
+                print(f"Response cache unavailable: {str(e)}")
+        if cached:
+            self.add_to_history(user_id, "assistant", cached)
+            self.schedule_summary(user_id)
+            return cached
+        
         if image_path:
-            required_tools.append("extract_ingredients_from_image")
-            image_result = self.tools.extract_ingredients_from_image(image_path)
-            tool_results = {"extract_ingredients_from_image": image_result}
-            if not image_result.get('success', False):
-                community_advice = self.memory_agent.get_community_insights(
-                    user_profile.get('segment', 'general_health'),
-                    self.extract_problem_type(message)
-                )
-                tool_results["community_advice"] = community_advice
-        else:
-            tool_results = self.execute_tools(user_id, required_tools, message)
-        enhanced_prompt = self.generate_enhanced_prompt(user_id, message, tool_results)
+            # The label is read first, then analyzed like typed ingredients
+            required_tools = list(dict.fromkeys(required_tools + ["extract_ingredients_from_image",
+                                                                  "analyze_ingredients"]))
+        tool_results = self.execute_tools(turn, required_tools)
+        image_result = tool_results.get("extract_ingredients_from_image")
+        if image_path and not (isinstance(image_result, dict) and image_result.get('success', False)):
+            tool_results["community_advice"] = turn.community_insights
+        enhanced_prompt = self.generate_enhanced_prompt(turn, tool_results)
         
         try:
-            response = ollama.chat(
-                model=self.model_name,
+            response = self.models.chat(
+                self.model_name,
                 messages=[{
                     'role': 'user',
                     'content': enhanced_prompt
@@ -360,7 +419,11 @@ class ChatbotAgent:
             )
             
             answer = response['message']['content'].strip()
+            self.prompt_builder.calibrate(enhanced_prompt, response.get('prompt_eval_count'))
+            if question_vector is not None:
+                self.response_cache.store(message, signature, answer, question_vector)
             self.add_to_history(user_id, "assistant", answer)
+            self.schedule_summary(user_id)
             if "similar users" in str(tool_results):
                 self.memory_agent.add_successful_recommendation(user_id, "consulted_similar_users")
             return answer
@@ -370,36 +433,105 @@ class ChatbotAgent:
             self.add_to_history(user_id, "assistant", error_msg)
             return error_msg
     
+    def cache_signature(self, turn):
+        profile = turn.user_profile
+        # Questions about different foods or baby ages must not share an answer
+        return profile_signature(turn.prompt_type, turn.segment, profile.get('age_group'),
+                                 profile.get('baby_age_months'), profile.get('medical_conditions', []),
+                                 profile.get('allergies', []), profile.get('diet_preferences', []),
+                                 food_signature(turn.message, turn.ingredients), turn.signals['baby_age'])
+    
     def get_conversation_history(self, user_id, max_messages=10):
-        if user_id not in self.conversation_histories:
-            self.conversation_histories[user_id] = []
-        return self.conversation_histories[user_id][-max_messages:]
+        return self.conversation_histories.get(user_id, [])[-max_messages:]
     
     def add_to_history(self, user_id, role, message):
-        if user_id not in self.conversation_histories:
-            self.conversation_histories[user_id] = []
-        
-        self.conversation_histories[user_id].append({
-            "role": role,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        if len(self.conversation_histories[user_id]) > 20:
-            self.conversation_histories[user_id] = self.conversation_histories[user_id][-20:]
+        with self.conversation_histories.edit(user_id, list) as history:
+            history.append({
+                "id": uuid.uuid4().hex,
+                "role": role,
+                "message": message,
+                "timestamp": datetime.now().isoformat()
+            })
+            
+            if len(history) > self.max_history:
+                # The summary worker is behind; keep the cut messages for its next summary
+                overflow = history[:-self.max_history]
+                del history[:-self.max_history]
+                with self.conversation_summaries.edit(user_id) as state:
+                    state['overflow'] = (state.get('overflow', []) + overflow)[-self.max_overflow:]
+    
+    def message_key(self, msg):
+        # Messages stored before ids were added are matched on their content
+        return msg.get('id') or (msg['timestamp'], msg['role'], msg['message'])
+    
+    def schedule_summary(self, user_id):
+        """Compresses older turns in the background once the history passes summary_threshold"""
+        if (len(self.conversation_histories.get(user_id, [])) <= self.summary_threshold
+                and not self.conversation_summaries.get(user_id, {}).get('overflow')):
+            return
+        with self.summarizing_lock:
+            if user_id in self.summarizing:
+                return
+            self.summarizing.add(user_id)
+        self.summary_executor.submit(self.update_summary, user_id)
+    
+    def update_summary(self, user_id):
+        try:
+            history = self.conversation_histories.get(user_id, [])
+            state = self.conversation_summaries.get(user_id, {})
+            older = state.get('overflow', []) + history[:-self.recent_messages]
+            if not older:
+                return
+            summary_prompt = f"""
+            Update the running summary of a health conversation with the new messages.
+            Keep the user's health concerns, conditions, children's ages, products discussed
+            and advice already given. Answer with the summary only, at most 120 words.
+            
+            CURRENT SUMMARY: {state.get('summary') or 'None yet'}
+            
+            NEW MESSAGES:
+            {self.format_messages(older)}
+            
+            UPDATED SUMMARY:
+            """
+            # Background work, so it only takes Ollama capacity chat turns leave free
+            with llm_context('batch', user_id):
+                response = self.models.chat(
+                    self.model_name,
+                    messages=[{'role': 'user', 'content': summary_prompt}],
+                    options={'temperature': 0.1, 'num_predict': 200}
+                )
+            summary = response['message']['content'].strip()
+            summarized = {self.message_key(msg) for msg in older}
+            
+            with self.conversation_summaries.edit(user_id) as state:
+                state['summary'] = summary
+                state['messages_summarized'] = state.get('messages_summarized', 0) + len(older)
+                state['updated_at'] = datetime.now().isoformat()
+                state['overflow'] = [msg for msg in state.get('overflow', []) if self.message_key(msg) not in summarized]
+            with self.conversation_histories.edit(user_id, list) as current:
+                # Exactly the summarized messages go; ones added meanwhile, even in the same
+                # clock tick, stay in the history
+                current[:] = [msg for msg in current if self.message_key(msg) not in summarized]
+        except Exception as e:
+            print(f"Summary update failed for {user_id}: {str(e)}")
+            return
+        finally:
+            with self.summarizing_lock:
+                self.summarizing.discard(user_id)
+        # The user may have kept chatting past the threshold meanwhile
+        self.schedule_summary(user_id)
+    
+    def format_messages(self, messages):
+        return "\n".join(f"{msg['role']}: {msg['message']}" for msg in messages)
     
     def determine_prompt_type(self, message):
-        message_lower = message.lower()
-        if any(word in message_lower for word in ['product', 'brand', 'ingredient', 'material']):
-            return "product_analysis"
-        elif any(word in message_lower for word in ['sick', 'disease', 'treatment', 'medicine', 'symptom', 'pain', 'hurt', 'feel']):
-            return "symptom_analysis"
-        else:
-            return "health_advice"
+        return detect(message)['prompt_type']
     
     def get_chat_summary(self, user_id):
         history = self.get_conversation_history(user_id, max_messages=50)
-        if not history:
+        earlier = self.conversation_summaries.get(user_id, {}).get('summary')
+        if not history and not earlier:
             return "No conversation history yet."
         
         user_profile = self.memory_agent.get_or_create_user_profile(user_id)
@@ -410,8 +542,10 @@ class ChatbotAgent:
         User Segment: {user_profile.get('segment', 'Unknown')}
         User Conditions: {', '.join(user_profile.get('medical_conditions', []))}
         
-        Conversation:
-        {''.join([f"{msg['role']}: {msg['message']}\n" for msg in history])}
+        Summary of earlier messages: {earlier or 'None'}
+        
+        Recent conversation:
+        {self.format_messages(history)}
         
         Provide a concise summary focusing on:
         - Main health concerns discussed
@@ -424,10 +558,12 @@ class ChatbotAgent:
         """
         
         try:
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[{'role': 'user', 'content': summary_prompt}]
-            )
+            # The user is waiting for it, like a chat turn
+            with llm_context('chat', user_id):
+                response = self.models.chat(
+                    self.model_name,
+                    messages=[{'role': 'user', 'content': summary_prompt}]
+                )
             return response['message']['content'].strip()
         except:
             return "Summary could not be generated."
\ No newline at end of file
@@ -2,6 +2,21 @@
 import json
 from datetime import datetime
 
+# What each tool needs before it can run and what it costs: 'llm' tools go to the shared
+# executor, 'local' ones are quick lookups run inline. A tool with same_as reuses that
+# tool's result instead of running again.
+TOOL_SPECS = {
+    "get_user_profile": {"depends_on": [], "cost": "local"},
+    "find_similar_users": {"depends_on": [], "cost": "local"},
+    "analyze_ingredients": {"depends_on": ["get_user_profile", "extract_ingredients_from_image"], "cost": "llm"},
+    "extract_ingredients_from_image": {"depends_on": [], "cost": "llm"},
+    "get_community_insights": {"depends_on": [], "cost": "local"},
+    "calculate_nutrition_risk": {"depends_on": ["get_user_profile", "extract_ingredients_from_image"], "cost": "llm",
+                                 "same_as": "analyze_ingredients"},
+    "get_age_specific_advice": {"depends_on": ["get_user_profile"], "cost": "local"},
+    "check_baby_safety": {"depends_on": ["get_user_profile", "extract_ingredients_from_image"], "cost": "llm"}
+}
+
 class ChatbotTools:
     def __init__(self, rag_agent=None, memory_agent=None, vision_agent=None):
         self.rag_agent = rag_agent
@@ -69,11 +84,17 @@ class ChatbotTools:
         return {"message": "No specific analysis available"}
     
     def extract_ingredients_from_image(self, image_path):
-        return {
-            "success": False,
-            "message": "Image analysis requires full vision agent setup",
-            "general_advice": "Please check the product label for ingredients"
-        }
+        if self.vision_agent:
+            result = self.vision_agent.extract_ingredients(image_path)
+            if not result['success']:
+                result["general_advice"] = "Please check the product label for ingredients"
+            return result
+        else:
+            return {
+                "success": False,
+                "message": "Image analysis requires full vision agent setup",
+                "general_advice": "Please check the product label for ingredients"
+            }
     
     def get_community_insights(self, product_type, user_segment):
         if self.memory_agent:
@@ -0,0 +1,59 @@
+# embedding_backends.py
+from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
+
+EMBEDDING_BACKENDS = ["torch", "torch_int8", "onnx", "onnx_int8"]
+
+# Pre-quantized export shipped in the all-MiniLM-L6-v2 repository; pick the
+# avx512 / arm64 variants instead on CPUs that support them.
+DEFAULT_INT8_ONNX_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """sentence-transformers encoder running on a CPU-oriented backend"""
+
+    def __init__(self, model_name, backend="onnx", num_threads=None, batch_size=32,
+                 onnx_file_name=DEFAULT_INT8_ONNX_FILE):
+        from sentence_transformers import SentenceTransformer
+        self.batch_size = batch_size
+
+        if backend in ("onnx", "onnx_int8"):
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            if num_threads:
+                session_options.intra_op_num_threads = num_threads
+            model_kwargs = {
+                'provider': 'CPUExecutionProvider',
+                'session_options': session_options
+            }
+            if backend == "onnx_int8":
+                model_kwargs['file_name'] = onnx_file_name
+            self.model = SentenceTransformer(model_name, device="cpu", backend="onnx",
+                                             model_kwargs=model_kwargs)
+        elif backend == "torch_int8":
+            import torch
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            model = SentenceTransformer(model_name, device="cpu")
+            self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+
+    def embed_documents(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                    show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make_embeddings(model_name, backend="torch", num_threads=None):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend} (choose from {EMBEDDING_BACKENDS})")
+    if backend == "torch":
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        return HuggingFaceEmbeddings(model_name=model_name)
+    return SentenceTransformerEmbeddings(model_name, backend=backend, num_threads=num_threads)
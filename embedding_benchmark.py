@@ -0,0 +1,64 @@
+# embedding_benchmark.py
+# Compares embedding backends on the hazard corpus: encode throughput, query
+# latency and retrieval parity (top-k overlap with the full precision model).
+#
+#   python embedding_benchmark.py hazard_ingredients_short.docx --threads 4
+import argparse
+import time
+import numpy as np
+from rag_agent import RAGAnalysisAgent, DIET_QUERIES
+from embedding_backends import EMBEDDING_BACKENDS, make_embeddings
+
+
+def top_k(doc_vectors, query_vectors, k):
+    distances = ((query_vectors[:, None, :] - doc_vectors[None, :, :]) ** 2).sum(axis=2)
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def benchmark_backend(backend, model_name, chunks, queries, threads, k):
+    encoder = make_embeddings(model_name, backend, threads)
+    encoder.embed_documents(chunks[:8])  # warm-up
+
+    start = time.perf_counter()
+    doc_vectors = np.array(encoder.embed_documents(chunks), dtype=np.float32)
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    query_vectors = np.array([encoder.embed_query(q) for q in queries], dtype=np.float32)
+    query_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    return {
+        'chunks_per_second': len(chunks) / encode_seconds,
+        'query_ms': query_ms,
+        'top_k': top_k(doc_vectors, query_vectors, k)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source_path")
+    parser.add_argument("--backends", nargs="+", default=EMBEDDING_BACKENDS)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    agent = RAGAnalysisAgent(args.source_path)
+    chunks = [doc.page_content for doc in agent.documents]
+    queries = list(DIET_QUERIES.values())
+    print(f"Corpus: {len(chunks)} chunks, {len(queries)} diet queries\n")
+
+    baseline = None
+    baseline_backend = None
+    for backend in args.backends:
+        try:
+            result = benchmark_backend(backend, agent.embedding_model, chunks, queries, args.threads, args.k)
+        except Exception as e:
+            print(f"{backend:12s} unavailable: {str(e)}")
+            continue
+        if baseline is None:
+            # The first backend that loads is the reference, not necessarily backends[0]
+            baseline = result['top_k']
+            baseline_backend = backend
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(result['top_k'], baseline)])
+        print(f"{backend:12s} {result['chunks_per_second']:8.1f} chunks/s  "
+              f"{result['query_ms']:6.2f} ms/query  overlap@{args.k} vs {baseline_backend}: {overlap:.2f}")
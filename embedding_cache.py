@@ -0,0 +1,116 @@
+# embedding_cache.py
+import atexit
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from langchain.embeddings.base import Embeddings
+
+
+class EmbeddingCache:
+    """Bounded LRU of query embeddings keyed by model name and normalized text"""
+
+    def __init__(self, max_entries=5000, persist_path=None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+        self.encoded_texts = 0
+        self.seconds_saved = 0.0
+        if persist_path:
+            if os.path.exists(persist_path):
+                self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.lower().split())
+
+    def get(self, model_name, text):
+        key = (model_name, self.normalize(text))
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if self.encoded_texts:
+                self.seconds_saved += self.encode_seconds / self.encoded_texts
+            return vector
+
+    def put(self, model_name, text, vector):
+        key = (model_name, self.normalize(text))
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def record_encode(self, seconds, count):
+        with self.lock:
+            self.encode_seconds += seconds
+            self.encoded_texts += count
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'encoder_seconds': self.encode_seconds,
+                'encoder_seconds_saved': self.seconds_saved
+            }
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self.lock:
+            data = list(self.entries.items())
+        with open(self.persist_path, 'wb') as f:
+            pickle.dump(data, f)
+
+    def load(self):
+        try:
+            with open(self.persist_path, 'rb') as f:
+                data = pickle.load(f)
+            with self.lock:
+                self.entries = OrderedDict(data[-self.max_entries:])
+            print(f"Embedding cache loaded: {len(self.entries)} entries")
+        except Exception as e:
+            print(f"Embedding cache could not be loaded: {str(e)}")
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated queries from an EmbeddingCache"""
+
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        # Index builds see every chunk once; caching them would only evict queries
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        vectors = [self.cache.get(self.model_name, text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Encode every miss in a single forward pass
+            start = time.perf_counter()
+            encoded = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.record_encode(time.perf_counter() - start, len(missing))
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self.cache.put(self.model_name, texts[i], vector)
+        return vectors
@@ -0,0 +1,86 @@
+# faiss_index.py
+import math
+import os
+import pickle
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain.docstore.in_memory import InMemoryDocstore
+
+INDEX_TYPES = ["flat", "ivf_flat", "ivf_pq", "hnsw"]
+
+# Below these sizes k-means / PQ training is unreliable and a flat index is fast anyway
+MIN_TRAIN_POINTS = {'ivf_flat': 1000, 'ivf_pq': 10000}
+
+
+def build_faiss_index(vectors, index_type="flat", nlist=None, pq_m=16, hnsw_m=32, train_sample=50000):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type} (choose from {INDEX_TYPES})")
+    n, dim = vectors.shape
+    if n < MIN_TRAIN_POINTS.get(index_type, 0):
+        print(f"Corpus too small for {index_type} ({n} vectors), using flat index")
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = 80
+    else:
+        # ~4*sqrt(n) lists, with at least 39 training points per centroid
+        nlist = min(nlist or int(4 * math.sqrt(n)), n // 39)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(n, min(n, train_sample), replace=False)]
+        index.train(sample)
+
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    if nprobe:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass  # not an IVF index
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def make_vector_store(index, documents, embeddings):
+    index_to_docstore_id = {i: str(i) for i in range(len(documents))}
+    docstore = InMemoryDocstore({str(i): doc for i, doc in enumerate(documents)})
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def recall_at_k(index, vectors, query_vectors, k=3):
+    """Share of the exact top-k neighbours that the index returns"""
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    _, expected = exact.search(query_vectors, k)
+    _, found = index.search(query_vectors, k)
+    hits = [len(set(e) & set(f)) / k for e, f in zip(expected, found)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def save_vector_store(vector_store, vectors, path):
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(vector_store.index, os.path.join(path, "index.faiss"))
+    np.save(os.path.join(path, "vectors.npy"), vectors)
+    with open(os.path.join(path, "docstore.pkl"), 'wb') as f:
+        pickle.dump((vector_store.docstore, vector_store.index_to_docstore_id), f)
+
+
+def load_vector_store(path, embeddings, mmap=True):
+    """Returns (vector_store, vectors); with mmap the index and vectors stay on disk"""
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode='r' if mmap else None)
+    with open(os.path.join(path, "docstore.pkl"), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id), vectors
@@ -0,0 +1,172 @@
+# hazard_matrix.py
+# Offline: precompute LLM verdicts for the most common ingredients x every diet.
+# Online: a product's verdict is a row lookup plus a max/min over its ingredients.
+#
+#   python hazard_matrix.py hazard_ingredients_short.docx labels.txt --top 500 --out hazard_matrix
+import argparse
+import json
+import os
+from collections import Counter
+import numpy as np
+from ingredient_parser import SYNONYMS, ingredient_ids, display_name
+from llm_scheduler import llm_context
+
+RISK_LEVELS = ['UNKNOWN', 'LOW', 'MEDIUM', 'HIGH']
+RISK_CODES = {level: code for code, level in enumerate(RISK_LEVELS)}
+UNSUITABLE, SUITABLE, UNKNOWN = 0, 1, -1
+
+
+class HazardMatrix:
+    def __init__(self, ingredients, diets, risk, suitable, evidence, evidence_docs=None):
+        self.ingredients = list(ingredients)
+        self.diets = list(diets)
+        self.row_index = {ingredient: i for i, ingredient in enumerate(self.ingredients)}
+        self.column_index = {diet: j for j, diet in enumerate(self.diets)}
+        self.risk = risk            # int8 [ingredients, diets], RISK_CODES
+        self.suitable = suitable    # int8 [ingredients, diets], SUITABLE / UNSUITABLE / UNKNOWN
+        self.evidence = evidence    # int32 [ingredients, diets, k], knowledge base doc ids, -1 padded
+        self.evidence_docs = evidence_docs or {}
+
+    @classmethod
+    def build(cls, rag_agent, ingredients, diets, evidence_k=2):
+        n, m = len(ingredients), len(diets)
+        risk = np.zeros((n, m), dtype=np.int8)
+        suitable = np.full((n, m), UNKNOWN, dtype=np.int8)
+        evidence = np.full((n, m, evidence_k), -1, dtype=np.int32)
+        evidence_docs = {}
+
+        # Offline work: only runs on Ollama capacity that chat and scans leave free
+        with llm_context('batch', 'hazard_matrix'):
+            for i, ingredient in enumerate(ingredients):
+                name = display_name(ingredient)
+                for j, diet in enumerate(diets):
+                    result = rag_agent.analyze_with_llm(name, diet)
+                    if result.get('error'):
+                        continue  # stays UNKNOWN, so the product falls back to the LLM online
+                    risk[i, j] = RISK_CODES.get(result['risk_level'], 0)
+                    suitable[i, j] = SUITABLE if result['suitable'] else UNSUITABLE
+                    doc_ids = rag_agent.hybrid_search_ids(f"{name} {diet}", evidence_k)
+                    evidence[i, j, :len(doc_ids)] = doc_ids
+                    for doc_id in doc_ids:
+                        evidence_docs[str(doc_id)] = rag_agent.documents[doc_id].metadata
+                print(f"[{i + 1}/{n}] {ingredient}")
+
+        return cls(ingredients, diets, risk, suitable, evidence, evidence_docs)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "risk.npy"), self.risk)
+        np.save(os.path.join(path, "suitable.npy"), self.suitable)
+        np.save(os.path.join(path, "evidence.npy"), self.evidence)
+        with open(os.path.join(path, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({'ingredients': self.ingredients, 'diets': self.diets,
+                       'evidence_docs': self.evidence_docs}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mode = 'r' if mmap else None
+        with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['ingredients'], meta['diets'],
+                   np.load(os.path.join(path, "risk.npy"), mmap_mode=mode),
+                   np.load(os.path.join(path, "suitable.npy"), mmap_mode=mode),
+                   np.load(os.path.join(path, "evidence.npy"), mmap_mode=mode),
+                   meta.get('evidence_docs'))
+
+    def lookup(self, ingredients, diets):
+        """
+        Returns (verdicts, unseen): verdicts per diet for the known ingredients, and
+        the ingredients the matrix has no complete row for
+        """
+        known_diets = [diet for diet in diets if diet in self.column_index]
+        columns = np.array([self.column_index[diet] for diet in known_diets], dtype=np.intp)
+        candidates = [(ingredient, self.row_index.get(ingredient)) for ingredient in ingredients]
+        unseen = [ingredient for ingredient, row in candidates if row is None]
+        rows = np.array([row for _, row in candidates if row is not None], dtype=np.intp)
+        if not len(rows) or not len(columns):
+            return {}, unseen + [self.ingredients[row] for row in rows]
+
+        # Rows with a failed offline verdict for any requested diet go to the LLM too
+        suitable = self.suitable[np.ix_(rows, columns)]
+        complete = (suitable != UNKNOWN).all(axis=1)
+        unseen += [self.ingredients[row] for row in rows[~complete]]
+        rows, suitable = rows[complete], suitable[complete]
+        if not len(rows):
+            return {}, unseen
+
+        unsuitable = suitable == UNSUITABLE
+        max_risk = self.risk[np.ix_(rows, columns)].max(axis=0)
+        verdicts = {}
+        for j, diet in enumerate(known_diets):
+            hazardous_rows = rows[unsuitable[:, j]]
+            evidence = np.unique(self.evidence[hazardous_rows, columns[j]].ravel())
+            verdicts[diet] = {
+                'suitable': not len(hazardous_rows),
+                'risk_level': RISK_LEVELS[int(max_risk[j])],
+                'hazardous_ingredients': [display_name(self.ingredients[row]) for row in hazardous_rows],
+                'evidence': [self.evidence_docs.get(str(doc_id), {}) for doc_id in evidence if doc_id >= 0]
+            }
+        return verdicts, unseen
+
+
+def verdict_to_result(verdict, diet):
+    hazardous = verdict['hazardous_ingredients']
+    if hazardous:
+        explanation = f"{', '.join(hazardous)} not suitable for {diet} (precomputed hazard check)."
+    else:
+        explanation = f"No known {diet} hazards among the listed ingredients (precomputed hazard check)."
+    return {
+        'suitable': verdict['suitable'],
+        'risk_level': verdict['risk_level'],
+        'explanation': explanation,
+        'hazardous_ingredients': hazardous if hazardous else ['No hazardous ingredients detected'],
+        'evidence': verdict['evidence'],
+        'source': 'hazard_matrix'
+    }
+
+
+def merge_results(matrix_result, llm_result):
+    """Combines the matrix verdict for known ingredients with the LLM verdict for the rest"""
+    if llm_result.get('error'):
+        if not matrix_result['suitable']:
+            # A known hazard already decides the diet; the unchecked ingredients cannot undo it
+            return {**matrix_result, 'explanation': f"{matrix_result['explanation']}\n{llm_result['explanation']}"}
+        return {**llm_result, 'evidence': matrix_result['evidence'], 'source': 'hazard_matrix+llm'}
+    hazardous = [h for result in (matrix_result, llm_result) for h in result['hazardous_ingredients']
+                 if h != 'No hazardous ingredients detected']
+    return {
+        'suitable': matrix_result['suitable'] and llm_result['suitable'],
+        'risk_level': max(matrix_result['risk_level'], llm_result['risk_level'], key=lambda r: RISK_CODES.get(r, 0)),
+        'explanation': f"{llm_result['explanation']}\n{matrix_result['explanation']}",
+        'hazardous_ingredients': hazardous if hazardous else ['No hazardous ingredients detected'],
+        'evidence': matrix_result['evidence'],
+        'source': 'hazard_matrix+llm'
+    }
+
+
+def top_ingredients(labels, n):
+    counts = Counter()
+    for label in labels:
+        counts.update(ingredient_ids(label))
+    return [ingredient for ingredient, _ in counts.most_common(n)]
+
+
+if __name__ == "__main__":
+    from rag_agent import RAGAnalysisAgent, DIET_QUERIES
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source_path", help="knowledge base file or directory")
+    parser.add_argument("labels", nargs="?", help="one ingredient label per line; defaults to the synonym dictionary")
+    parser.add_argument("--top", type=int, default=500)
+    parser.add_argument("--out", default="hazard_matrix")
+    args = parser.parse_args()
+
+    if args.labels:
+        with open(args.labels, encoding='utf-8') as f:
+            ingredients = top_ingredients(f, args.top)
+    else:
+        ingredients = list(SYNONYMS)[:args.top]
+
+    agent = RAGAnalysisAgent(args.source_path)
+    matrix = HazardMatrix.build(agent, ingredients, list(DIET_QUERIES))
+    matrix.save(args.out)
+    print(f"Saved {len(ingredients)} x {len(DIET_QUERIES)} hazard matrix to {args.out}")
@@ -0,0 +1,158 @@
+# ingestion.py
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from langchain.schema import Document
+
+SUPPORTED_EXTENSIONS = {'.docx', '.pdf', '.md', '.markdown', '.csv'}
+
+
+def iter_source_files(source_path):
+    if os.path.isfile(source_path):
+        yield source_path
+        return
+    for root, _, files in os.walk(source_path):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS and not name.startswith('~$'):
+                yield os.path.join(root, name)
+
+
+# Each parser yields (kind, text) units in document order; kind is heading, paragraph or row
+
+def parse_docx(path):
+    import docx
+    doc = docx.Document(path)
+    for block in doc.iter_inner_content():
+        if hasattr(block, 'rows'):
+            header = None
+            for row in block.rows:
+                cells = [cell.text.strip() for cell in row.cells]
+                if header is None:
+                    header = cells
+                    continue
+                yield 'row', "; ".join(f"{h}: {c}" if h else c for h, c in zip(header, cells) if c)
+        else:
+            text = block.text.strip()
+            if not text:
+                continue
+            style = block.style.name if block.style is not None else ""
+            yield ('heading' if style.startswith('Heading') or style == 'Title' else 'paragraph'), text
+
+
+def parse_pdf(path):
+    from pypdf import PdfReader
+    for page_number, page in enumerate(PdfReader(path).pages, start=1):
+        yield 'heading', f"Page {page_number}"
+        for paragraph in (page.extract_text() or "").split("\n\n"):
+            if paragraph.strip():
+                yield 'paragraph', " ".join(paragraph.split())
+
+
+def parse_markdown(path):
+    paragraph = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#') or line.startswith('|') or not line:
+                if paragraph:
+                    yield 'paragraph', " ".join(paragraph)
+                    paragraph = []
+                if line.startswith('#'):
+                    yield 'heading', line.lstrip('#').strip()
+                elif line.startswith('|') and not set(line) <= set('|-: '):
+                    yield 'row', " ".join(cell.strip() for cell in line.strip('|').split('|'))
+            else:
+                paragraph.append(line)
+    if paragraph:
+        yield 'paragraph', " ".join(paragraph)
+
+
+def parse_csv(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield 'row', "; ".join(f"{k}: {v}" for k, v in row.items() if k and v)
+
+
+PARSERS = {
+    '.docx': parse_docx,
+    '.pdf': parse_pdf,
+    '.md': parse_markdown,
+    '.markdown': parse_markdown,
+    '.csv': parse_csv
+}
+
+
+def chunk_units(units, source, chunk_size=500):
+    """Packs whole units into chunks; a heading always starts a new chunk"""
+    chunks = []
+    section = os.path.splitext(os.path.basename(source))[0]
+    current = []
+    length = 0
+
+    def flush():
+        if current:
+            chunks.append({
+                'text': section + "\n" + "\n".join(current),
+                'metadata': {'source': source, 'section': section, 'chunk': len(chunks)}
+            })
+
+    for kind, text in units:
+        if kind == 'heading':
+            flush()
+            current, length = [], 0
+            section = text
+            continue
+        # Oversized paragraphs are the only units that get split
+        pieces = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] if len(text) > chunk_size else [text]
+        for piece in pieces:
+            if current and length + len(piece) > chunk_size:
+                flush()
+                current, length = [], 0
+            current.append(piece)
+            length += len(piece) + 1
+    flush()
+    return chunks
+
+
+def parse_file(path, chunk_size=500):
+    parser = PARSERS[os.path.splitext(path)[1].lower()]
+    return chunk_units(parser(path), path, chunk_size)
+
+
+def stream_documents(source_path, chunk_size=500, workers=None):
+    """Yields Documents file by file as soon as each file is parsed"""
+    paths = list(iter_source_files(source_path))
+    if not paths:
+        raise FileNotFoundError(f"No supported documents found in {source_path}")
+
+    if len(paths) == 1 or workers == 1:
+        for path in paths:
+            yield from to_documents(path, lambda: parse_file(path, chunk_size))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(parse_file, path, chunk_size): path for path in paths}
+        for future in as_completed(futures):
+            yield from to_documents(futures[future], future.result)
+
+
+def to_documents(path, get_chunks):
+    try:
+        chunks = get_chunks()
+    except Exception as e:
+        print(f"Skipping {path}: {str(e)}")
+        return
+    for chunk in chunks:
+        yield Document(page_content=chunk['text'], metadata=chunk['metadata'])
+
+
+def embed_in_batches(documents, embeddings, batch_size=64):
+    """Yields (documents, vectors) so encoding overlaps with parsing of the remaining files"""
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch, embeddings.embed_documents([d.page_content for d in batch])
+            batch = []
+    if batch:
+        yield batch, embeddings.embed_documents([d.page_content for d in batch])
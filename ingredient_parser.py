@@ -0,0 +1,300 @@
+# ingredient_parser.py
+import re
+import time
+import unicodedata
+from functools import lru_cache
+
+# canonical id -> surface forms (en, fr, de, es, it, tr); additives use their E-number as id
+SYNONYMS = {
+    'wheat': ['wheat', 'blé', 'ble', 'weizen', 'trigo', 'grano', 'frumento', 'buğday'],
+    'wheat_flour': ['wheat flour', 'farine de blé', 'weizenmehl', 'harina de trigo', 'farina di grano',
+                    'buğday unu', 'flour', 'enriched flour'],
+    'gluten': ['gluten', 'wheat gluten', 'glutine'],
+    'barley': ['barley', 'orge', 'gerste', 'cebada', 'orzo', 'arpa'],
+    'barley_malt': ['barley malt', 'malt', 'malt extract', 'barley malt extract', 'extrait de malt', 'malzextrakt'],
+    'rye': ['rye', 'seigle', 'roggen', 'centeno', 'segale', 'çavdar'],
+    'oats': ['oats', 'oat', 'avoine', 'hafer', 'avena', 'yulaf', 'oat flakes', 'rolled oats'],
+    'milk': ['milk', 'whole milk', 'skimmed milk', 'lait', 'milch', 'leche', 'latte', 'süt', 'cow milk',
+             'lait entier', 'lait écrémé', 'vollmilch', 'leche entera', 'latte intero', 'tam yağlı süt',
+             'milk powder', 'skimmed milk powder', 'whole milk powder', 'lait en poudre', 'milchpulver',
+             'magermilchpulver', 'vollmilchpulver', 'süt tozu', 'yağsız süt tozu'],
+    'cream': ['cream', 'crème', 'sahne', 'nata', 'panna', 'krema'],
+    'butter': ['butter', 'beurre', 'mantequilla', 'burro', 'tereyağı'],
+    'cheese': ['cheese', 'fromage', 'käse', 'queso', 'formaggio', 'peynir'],
+    'yogurt': ['yogurt', 'yoghurt', 'yaourt', 'joghurt', 'yogur', 'yoğurt'],
+    'whey': ['whey', 'whey powder', 'lactosérum', 'petit-lait', 'molke', 'suero de leche', 'siero di latte', 'peynir altı suyu'],
+    'lactose': ['lactose', 'laktose', 'lactosa', 'lattosio', 'laktoz'],
+    'casein': ['casein', 'caseinate', 'sodium caseinate', 'caséine', 'kasein', 'caseína', 'kazein'],
+    'egg': ['egg', 'eggs', 'whole egg', 'egg powder', 'oeuf', 'oeufs', 'ei', 'eier', 'huevo', 'uovo', 'uova', 'yumurta'],
+    'egg_white': ['egg white', 'egg whites', "blanc d'oeuf", 'eiweiß', 'clara de huevo', 'albume', 'yumurta akı'],
+    'egg_yolk': ['egg yolk', "jaune d'oeuf", 'eigelb', 'yema de huevo', "tuorlo d'uovo", 'yumurta sarısı'],
+    'honey': ['honey', 'miel', 'honig', 'miele', 'bal'],
+    'sugar': ['sugar', 'sucre', 'zucker', 'azúcar', 'azucar', 'zucchero', 'şeker', 'seker', 'cane sugar',
+              'brown sugar', 'sucrose'],
+    'glucose': ['glucose', 'dextrose', 'glukose', 'glucosa', 'glukoz'],
+    'glucose_syrup': ['glucose syrup', 'sirop de glucose', 'glukosesirup', 'jarabe de glucosa', 'sciroppo di glucosio',
+                      'glukoz şurubu', 'glikoz şurubu', 'corn syrup'],
+    'fructose': ['fructose', 'fruktose', 'fructosa', 'fruttosio', 'fruktoz'],
+    'hfcs': ['high fructose corn syrup', 'glucose-fructose syrup', 'glucose fructose syrup', 'hfcs',
+             'sirop de glucose-fructose', 'glukose-fruktose-sirup', 'glikoz-fruktoz şurubu'],
+    'salt': ['salt', 'sel', 'salz', 'sal', 'sale', 'tuz', 'sea salt', 'iodized salt'],
+    'sodium': ['sodium', 'natrium'],
+    'palm_oil': ['palm oil', 'huile de palme', 'palmöl', 'aceite de palma', 'olio di palma', 'palm yağı',
+                 'palm fat', 'palm kernel oil', 'palm'],
+    'sunflower_oil': ['sunflower oil', 'huile de tournesol', 'sonnenblumenöl', 'aceite de girasol', 'olio di girasole',
+                      'ayçiçek yağı'],
+    'vegetable_oil': ['vegetable oil', 'huile végétale', 'pflanzenöl', 'aceite vegetal', 'olio vegetale',
+                      'bitkisel yağ'],
+    'hydrogenated_fat': ['hydrogenated vegetable oil', 'hydrogenated fat', 'partially hydrogenated oil', 'trans fat'],
+    'soy': ['soy', 'soya', 'soja', 'soybean', 'soybeans', 'soia', 'tofu'],
+    'soy_lecithin': ['soy lecithin', 'soya lecithin', 'lécithine de soja', 'sojalecithin', 'lecitina de soja',
+                     'lecitina di soia', 'soya lesitini', 'soy lesitin'],
+    'soy_protein': ['soy protein', 'soya protein', 'protéine de soja', 'sojaprotein', 'proteína de soja'],
+    'peanut': ['peanut', 'peanuts', 'arachide', 'arachides', 'erdnuss', 'erdnüsse', 'cacahuete', 'yer fıstığı'],
+    'almond': ['almond', 'almonds', 'amande', 'amandes', 'mandel', 'mandeln', 'almendra', 'mandorla', 'badem'],
+    'hazelnut': ['hazelnut', 'hazelnuts', 'noisette', 'noisettes', 'haselnuss', 'haselnüsse', 'avellana', 'nocciola',
+                 'nocciole', 'fındık'],
+    'walnut': ['walnut', 'walnuts', 'noix', 'walnuss', 'nuez', 'noce', 'ceviz'],
+    'cashew': ['cashew', 'cashews', 'cajou', 'anacardo', 'kaju'],
+    'pistachio': ['pistachio', 'pistachios', 'pistache', 'pistazie', 'pistacho', 'pistacchio', 'antep fıstığı'],
+    'cocoa': ['cocoa', 'cocoa powder', 'cacao', 'kakao', 'cocoa mass'],
+    'cocoa_butter': ['cocoa butter', 'beurre de cacao', 'kakaobutter', 'manteca de cacao', 'burro di cacao',
+                     'kakao yağı'],
+    'gelatin': ['gelatin', 'gelatine', 'gélatine', 'gelatina', 'jelatin', 'e441'],
+    'beef': ['beef', 'boeuf', 'rind', 'rindfleisch', 'ternera', 'manzo', 'sığır eti', 'dana eti'],
+    'pork': ['pork', 'porc', 'schwein', 'schweinefleisch', 'cerdo', 'maiale', 'domuz eti'],
+    'chicken': ['chicken', 'poulet', 'huhn', 'hähnchen', 'pollo', 'tavuk'],
+    'fish': ['fish', 'poisson', 'fisch', 'pescado', 'pesce', 'balık'],
+    'corn': ['corn', 'maize', 'maïs', 'mais', 'maíz', 'mısır'],
+    'rice': ['rice', 'riz', 'reis', 'arroz', 'riso', 'pirinç'],
+    'yeast': ['yeast', 'levure', 'hefe', 'levadura', 'lievito', 'maya'],
+    'water': ['water', 'eau', 'wasser', 'agua', 'acqua', 'su'],
+    'e322': ['lecithin', 'lecithins', 'lécithine', 'lecitina', 'lesitin'],
+    'e330': ['citric acid', 'acide citrique', 'zitronensäure', 'ácido cítrico', 'acido citrico', 'sitrik asit'],
+    'e300': ['ascorbic acid', 'vitamin c', 'acide ascorbique', 'ascorbinsäure', 'askorbik asit'],
+    'e471': ['mono- and diglycerides of fatty acids', 'mono and diglycerides of fatty acids',
+             'mono- and diglycerides', 'mono and diglycerides', 'mono- et diglycérides d\'acides gras',
+             'mono- und diglyceride von speisefettsäuren', 'yağ asitlerinin mono ve digliseritleri'],
+    'e621': ['monosodium glutamate', 'msg', 'glutamate monosodique', 'mononatriumglutamat', 'glutamato monosódico'],
+    'e250': ['sodium nitrite', 'nitrite de sodium', 'natriumnitrit', 'nitrito de sodio', 'sodyum nitrit'],
+    'e211': ['sodium benzoate', 'benzoate de sodium', 'natriumbenzoat', 'benzoato de sodio', 'sodyum benzoat'],
+    'e202': ['potassium sorbate', 'sorbate de potassium', 'kaliumsorbat', 'sorbato de potasio', 'potasyum sorbat'],
+    'e951': ['aspartame', 'aspartam'],
+    'e955': ['sucralose', 'sukraloz'],
+    'e420': ['sorbitol'],
+    'e407': ['carrageenan', 'carraghénane', 'carrageen', 'karragenan'],
+    'e415': ['xanthan gum', 'gomme xanthane', 'xanthan', 'goma xantana', 'ksantan gam'],
+    'e120': ['carmine', 'cochineal', 'carmin', 'karmin'],
+    'e102': ['tartrazine', 'tartrazin'],
+    'e129': ['allura red', 'allura red ac'],
+    'e150d': ['sulphite ammonia caramel', 'caramel color', 'caramel colour'],
+    'e500': ['sodium bicarbonate', 'baking soda', 'bicarbonate de sodium', 'natron', 'sodyum bikarbonat'],
+    'e503': ['ammonium carbonate', 'ammonium bicarbonate']
+}
+
+DISPLAY_NAMES = {
+    'e322': 'lecithin (E322)', 'e330': 'citric acid (E330)', 'e300': 'ascorbic acid (E300)',
+    'e471': 'mono- and diglycerides (E471)', 'e621': 'monosodium glutamate (E621)', 'e250': 'sodium nitrite (E250)',
+    'e211': 'sodium benzoate (E211)', 'e202': 'potassium sorbate (E202)', 'e951': 'aspartame (E951)',
+    'e955': 'sucralose (E955)', 'e420': 'sorbitol (E420)', 'e407': 'carrageenan (E407)',
+    'e415': 'xanthan gum (E415)', 'e120': 'carmine (E120)', 'e102': 'tartrazine (E102)',
+    'e129': 'allura red (E129)', 'e150d': 'caramel color (E150d)', 'e500': 'sodium bicarbonate (E500)',
+    'e503': 'ammonium carbonate (E503)', 'hfcs': 'high fructose corn syrup'
+}
+
+# Additive class names only announce their members: "emulsifier (e322)" is just e322
+ADDITIVE_CLASSES = [
+    'emulsifier', 'emulsifiers', 'émulsifiant', 'émulsifiants', 'emulgator', 'emulgatoren', 'emulsionante',
+    'emulsionantes', 'emülgatör', 'emülgatörler', 'raising agent', 'raising agents', 'leavening agent',
+    'leavening agents', 'poudre à lever', 'backtriebmittel', 'gasificante', 'agenti lievitanti', 'kabartıcı',
+    'kabartıcılar', 'acidity regulator', 'acidity regulators', 'correcteur d\'acidité', 'säureregulator',
+    'corrector de acidez', 'correttore di acidità', 'asitlik düzenleyici', 'preservative', 'preservatives',
+    'conservateur', 'konservierungsstoff', 'conservante', 'koruyucu', 'stabilizer', 'stabilizers', 'stabiliser',
+    'stabilisers', 'stabilisant', 'stabilisator', 'estabilizante', 'stabilizzante', 'stabilizatör', 'thickener',
+    'thickeners', 'épaississant', 'verdickungsmittel', 'espesante', 'addensante', 'kıvam arttırıcı', 'colour',
+    'colours', 'color', 'colors', 'colouring', 'colorant', 'farbstoff', 'colorante', 'renklendirici',
+    'antioxidant', 'antioxidants', 'antioxydant', 'antioxidationsmittel', 'antioxidante', 'antiossidante',
+    'antioksidan', 'sweetener', 'sweeteners', 'édulcorant', 'süßungsmittel', 'edulcorante', 'tatlandırıcı',
+    'flavour enhancer', 'flavor enhancer', 'exhausteur de goût', 'geschmacksverstärker', 'potenciador del sabor',
+    'aroma güçlendirici', 'gelling agent', 'gélifiant', 'geliermittel', 'gelificante', 'jelleştirici',
+    'acidifier', 'acidulant', 'säuerungsmittel', 'acidulante', 'humectant', 'feuchthaltemittel'
+]
+
+PREFIX_PATTERN = re.compile(
+    r"^\s*(ingredients?|ingr[ée]dients?|zutaten|ingredienti|ingredientes|içindekiler|i̇çindekiler|bileşenler|"
+    r"contains|composition)\s*[:\-]\s*", re.IGNORECASE)
+# A comma between digits is a decimal comma ("8,7%"), not a separator
+DELIMITER_PATTERN = re.compile(r"(?<!\d),|,(?!\d)|[;()\[\]{}]")
+PERCENT_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*%")
+E_NUMBER_PATTERN = re.compile(r"\be[\s-]?(\d{3,4}[a-z]?)\b")
+CLEANUP_PATTERN = re.compile(r"[_*†]+|\s+")
+
+OPENING = '([{'
+CLOSING = ')]}'
+
+
+def normalize_text(text):
+    text = text.lower().replace('ı', 'i').replace('œ', 'oe')
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return CLEANUP_PATTERN.sub(' ', text).strip(' .:-')
+
+
+# Precomputed, accent-folded surface form -> canonical id
+SYNONYM_INDEX = {normalize_text(form): canonical
+                 for canonical, forms in SYNONYMS.items() for form in forms}
+SYNONYM_INDEX.update({canonical: canonical for canonical in SYNONYMS})
+ADDITIVE_CLASS_INDEX = frozenset(normalize_text(name) for name in ADDITIVE_CLASSES)
+# Any known food named anywhere in free text, longest form first ("egg yolk" before "egg")
+MENTION_PATTERN = re.compile(r"\b(" + "|".join(re.escape(form) for form in sorted(SYNONYM_INDEX, key=len, reverse=True))
+                             + r")\b")
+
+
+@lru_cache(maxsize=100000)
+def canonical_id(name):
+    if name in SYNONYM_INDEX:
+        return SYNONYM_INDEX[name]
+    e_number = E_NUMBER_PATTERN.fullmatch(name)
+    if e_number:
+        return 'e' + e_number.group(1)
+    # Only exact synonyms are merged: a known phrase inside a name is often a different
+    # ingredient ("buckwheat flour", "coconut milk", "cocoa butter")
+    return name.replace(' ', '_')
+
+
+def make_ingredient(raw, children):
+    percent = None
+    percent_match = PERCENT_PATTERN.search(raw)
+    if percent_match:
+        percent = float(percent_match.group(1).replace(',', '.'))
+        raw = raw[:percent_match.start()] + raw[percent_match.end():]
+    name = normalize_text(raw)
+    # "emulsifier: soy lecithin" keeps the ingredient and drops the class name
+    if ':' in name:
+        name = name.split(':', 1)[1].strip()
+    if name.startswith('and '):
+        name = name[4:]
+    if not name and not children:
+        return None
+    e_number = E_NUMBER_PATTERN.fullmatch(name)
+    return {
+        'name': name,
+        # The class name is a heading for its children, not an ingredient to check
+        'id': canonical_id(name) if name and name not in ADDITIVE_CLASS_INDEX else None,
+        'percent': percent,
+        'e_number': 'e' + e_number.group(1) if e_number else None,
+        'sub_ingredients': children
+    }
+
+
+def parse_ingredients(text):
+    """Parses a label into a list of ingredient dicts with nested sub_ingredients"""
+    if not text:
+        return []
+    text = PREFIX_PATTERN.sub('', text, count=1)
+    frames = [{'items': [], 'text': ''}]
+    pos = 0
+    for match in DELIMITER_PATTERN.finditer(text):
+        frames[-1]['text'] += text[pos:match.start()]
+        pos = match.end()
+        delimiter = match.group()
+        if delimiter in OPENING:
+            frames.append({'items': [], 'text': ''})
+        elif delimiter in CLOSING:
+            if len(frames) > 1:
+                close_frame(frames)
+        else:
+            finish_item(frames[-1])
+    frames[-1]['text'] += text[pos:]
+    while len(frames) > 1:
+        close_frame(frames)
+    finish_item(frames[0])
+    return frames[0]['items']
+
+
+def finish_item(frame):
+    ingredient = make_ingredient(frame['text'], frame.pop('children', []))
+    frame['text'] = ''
+    percent = frame.pop('percent', None)
+    if ingredient is None:
+        return
+    if ingredient['percent'] is None:
+        ingredient['percent'] = percent
+    frame['items'].append(ingredient)
+
+
+def close_frame(frames):
+    inner = frames.pop()
+    outer = frames[-1]
+    note = PERCENT_PATTERN.fullmatch(inner['text'].strip()) if not inner['items'] else None
+    if note:
+        # "hazelnuts (13%)": the parenthesis only carries the share of its ingredient
+        outer['percent'] = float(note.group(1).replace(',', '.'))
+        return
+    finish_item(inner)
+    outer.setdefault('children', []).extend(inner['items'])
+
+
+def flatten(ingredients):
+    for ingredient in ingredients:
+        yield ingredient
+        yield from flatten(ingredient['sub_ingredients'])
+
+
+@lru_cache(maxsize=20000)
+def ingredient_ids(text):
+    """Normalized ingredient set of a label, sub-ingredients included"""
+    return frozenset(item['id'] for item in flatten(parse_ingredients(text)) if item['id'])
+
+
+@lru_cache(maxsize=20000)
+def mentioned_ids(text):
+    """Canonical ids of the foods a sentence mentions, e.g. "can my baby have honey?" -> {'honey'}"""
+    text = normalize_text(text)
+    ids = {SYNONYM_INDEX[match] for match in MENTION_PATTERN.findall(text)}
+    ids.update(f"e{number}" for number in E_NUMBER_PATTERN.findall(text))
+    return frozenset(ids)
+
+
+@lru_cache(maxsize=20000)
+def normalize_label(text):
+    """Canonical, compact rendering of a raw label"""
+    return format_ingredients(parse_ingredients(text))
+
+
+def display_name(ingredient_id):
+    return DISPLAY_NAMES.get(ingredient_id, ingredient_id.replace('_', ' '))
+
+
+def format_ingredients(ingredients):
+    """Compact normalized label text, e.g. for LLM prompts"""
+    parts = []
+    for item in ingredients:
+        text = display_name(item['id']) if item['id'] else item['name']
+        if item['percent'] is not None:
+            text += f" {item['percent']:g}%"
+        if item['sub_ingredients']:
+            text += f" ({format_ingredients(item['sub_ingredients'])})"
+        parts.append(text)
+    return ", ".join(parts)
+
+
+if __name__ == "__main__":
+    labels = [
+        "Ingredients: wheat flour (62%), sugar, palm oil, emulsifier (soy lecithin, E471), salt, raising agent: E500",
+        "Zutaten: Zucker, Haselnüsse (13%), Magermilchpulver (8,7%), Kakao, Emulgator: Lecithine (Soja), Vanillin",
+        "İçindekiler: buğday unu, şeker, bitkisel yağ (palm), glikoz şurubu, tuz, kabartıcılar (E500, E503)",
+        "Ingrédients: lait entier, sucre, crème (lait), amidon de maïs, gélatine, arôme naturel de vanille",
+        "chocolate [sugar, cocoa butter, cocoa mass, milk powder (milk), emulsifier (e-322)], almonds 20%, honey"
+    ]
+    for label in labels:
+        parsed = parse_ingredients(label)
+        print(format_ingredients(parsed))
+        print("  ids:", sorted(ingredient_ids(label)))
+
+    # Unique labels so the per-label cache does not flatter the result
+    corpus = [f"{label}, batch {i}" for i in range(4000) for label in labels]
+    start = time.perf_counter()
+    for label in corpus:
+        parse_ingredients(label)
+    elapsed = time.perf_counter() - start
+    print(f"\nParsed {len(corpus)} labels in {elapsed:.2f}s ({len(corpus) / elapsed:,.0f} labels/s)")
@@ -0,0 +1,247 @@
+# intent_detector.py
+# One regex pass over a chat message finds every routing term; tool, prompt type, problem
+# type, product type, keyword and profile decisions are then set lookups. Matching keeps
+# the substring semantics of the old any(word in message_lower ...) checks.
+import re
+from functools import lru_cache
+
+TOOL_TERMS = [
+    ('find_similar_users', ['similar', 'other', 'another', 'same', 'else']),
+    ('analyze_ingredients', ['ingredient', 'content', 'material', 'contains']),
+    ('extract_ingredients_from_image', ['photo', 'image', 'picture']),
+    ('check_baby_safety', ['baby', 'child', 'infant', 'toddler']),
+    ('get_age_specific_advice', ['baby', 'child', 'infant', 'toddler']),
+    ('calculate_nutrition_risk', ['risk', 'safe', 'dangerous', 'healthy']),
+    ('find_similar_users', ['bloating', 'pain', 'hurt', 'symptom', 'feel bad'])
+]
+SYMPTOM_TERMS = ['bloating', 'pain', 'hurt', 'symptom', 'feel bad']
+
+HEALTH_KEYWORDS = [
+    'diabetes', 'sugar', 'heart', 'blood pressure', 'allergy', 'diet',
+    'nutrition', 'vitamin', 'mineral', 'protein', 'fat', 'carbohydrate',
+    'baby', 'child', 'pregnant', 'elderly', 'sport', 'exercise',
+    'medicine', 'treatment', 'symptom', 'diagnosis', 'cholesterol', 'obesity',
+    'celiac', 'gluten', 'lactose', 'vegan', 'vegetarian', 'bloating', 'pain'
+]
+
+# First matching entry wins, as in the if / elif chains these replace
+PROBLEM_TYPES = [
+    ('child_health', ['baby', 'infant', 'child']),
+    ('digestive_issues', ['bloating', 'stomach', 'digest']),
+    ('diabetes', ['sugar', 'diabet']),
+    ('heart_health', ['heart', 'blood pressure'])
+]
+PROMPT_TYPES = [
+    ('product_analysis', ['product', 'brand', 'ingredient', 'material']),
+    ('symptom_analysis', ['sick', 'disease', 'treatment', 'medicine', 'symptom', 'pain', 'hurt', 'feel'])
+]
+PRODUCT_TYPES = ['formula', 'cereal', 'yogurt', 'milk', 'cheese', 'bread', 'drink', 'snack', 'baby food']
+INGREDIENT_MARKERS = ['ingredients', 'contains', 'made with', 'composition', 'made from']
+
+# EnhancedChatbot profile extraction
+SIX_MONTH_TERMS = ['6-month', '6 month']
+MEDICAL_KEYWORDS = {
+    'diabetes': ['diabet', 'şeker'],
+    'allergy': ['allerg', 'alerj'],
+    'lactose': ['lactose', 'laktoz'],
+    'gluten': ['gluten', 'çölyak'],
+    'heart': ['heart', 'kalp']
+}
+
+AGE_PATTERN = re.compile(r'(\d+)\s*(years?|year|yaş|yaşındayım)')
+BABY_AGE_PATTERN = re.compile(r'(\d+)\s*(month|months|monthly|mo)')
+SENTENCE_END_PATTERN = re.compile(r"[.?!](\s|$)|\n")
+
+ALL_TERMS = sorted({term for _, terms in TOOL_TERMS + PROBLEM_TYPES + PROMPT_TYPES for term in terms} |
+                   set(HEALTH_KEYWORDS) | set(PRODUCT_TYPES) | set(INGREDIENT_MARKERS) |
+                   set(SIX_MONTH_TERMS) | {term for terms in MEDICAL_KEYWORDS.values() for term in terms})
+
+
+def trie_pattern(terms):
+    """Alternation factored into a trie, longest match first, so each position costs one walk"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A term ending here makes the longer continuations optional
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+TERM_PATTERN = re.compile(trie_pattern(ALL_TERMS))
+# A match is the longest term starting at its position; the shorter terms inside it are
+# found through CONTAINED_TERMS as (term, offset)
+CONTAINED_TERMS = {term: [(other, term.find(other)) for other in ALL_TERMS if other in term] for term in ALL_TERMS}
+
+
+def restart_offset(term):
+    """Where the next search may start: the first offset at which another term could begin inside
+    this one and run past its end ("sa" of "pain" + "same"), otherwise the end of the match"""
+    for offset in range(1, len(term)):
+        tail = term[offset:]
+        if any(other.startswith(tail) and len(other) > len(tail) for other in ALL_TERMS):
+            return offset
+    return len(term)
+
+
+RESTART_OFFSETS = {term: restart_offset(term) for term in ALL_TERMS}
+
+
+def find_terms(text_lower):
+    """{term: first position} for every routing term occurring in the text"""
+    found = {}
+    position = 0
+    while True:
+        match = TERM_PATTERN.search(text_lower, position)
+        if match is None:
+            return found
+        term = match.group()
+        start = match.start()
+        for other, offset in CONTAINED_TERMS[term]:
+            if start + offset < found.get(other, len(text_lower)):
+                found[other] = start + offset
+        position = start + RESTART_OFFSETS[term]
+
+
+def first_group(groups, found, default):
+    return next((name for name, terms in groups if not found.isdisjoint(terms)), default)
+
+
+@lru_cache(maxsize=1024)
+def detect(message):
+    """Every routing signal of a message; the result is shared between callers, do not modify it"""
+    text_lower = message.lower()
+    positions = find_terms(text_lower)
+    found = positions.keys()
+
+    ingredients = None
+    marker = next((m for m in INGREDIENT_MARKERS if m in positions), None)
+    if marker:
+        # The list runs to the end of the sentence; the ingredient parser does the rest
+        rest = message[positions[marker] + len(marker):].lstrip(' :')
+        end = SENTENCE_END_PATTERN.search(rest)
+        ingredients = rest[:end.start()] if end else rest
+
+    baby_age = BABY_AGE_PATTERN.search(message)
+    age = AGE_PATTERN.search(text_lower)
+    return {
+        'tools': tuple(dict.fromkeys(tool for tool, terms in TOOL_TERMS if not found.isdisjoint(terms))),
+        'symptom': not found.isdisjoint(SYMPTOM_TERMS),
+        'keywords': tuple(k for k in HEALTH_KEYWORDS if k in positions) or ('general health',),
+        'problem_type': first_group(PROBLEM_TYPES, found, 'general_health'),
+        'prompt_type': first_group(PROMPT_TYPES, found, 'health_advice'),
+        'product_type': next((p for p in PRODUCT_TYPES if p in positions), 'general'),
+        'ingredients': ingredients,
+        'baby_age': int(baby_age.group(1)) if baby_age else 6,
+        'age': int(age.group(1)) if age else None,
+        'six_months': not found.isdisjoint(SIX_MONTH_TERMS),
+        'conditions': tuple(c for c, terms in MEDICAL_KEYWORDS.items() if not found.isdisjoint(terms))
+    }
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Reference: what the chatbot methods computed before, each lowering and scanning on its own
+    def scan_tools(message):
+        message_lower = message.lower()
+        return tuple(dict.fromkeys(tool for tool, terms in TOOL_TERMS if any(w in message_lower for w in terms)))
+
+    def scan_keywords(text):
+        text_lower = text.lower()
+        return tuple(k for k in HEALTH_KEYWORDS if k in text_lower) or ('general health',)
+
+    def scan_groups(text, groups, default):
+        text_lower = text.lower()
+        return next((name for name, terms in groups if any(w in text_lower for w in terms)), default)
+
+    def scan_product_type(text):
+        text_lower = text.lower()
+        return next((p for p in PRODUCT_TYPES if p in text_lower), 'general')
+
+    def scan_ingredients(text):
+        for keyword in INGREDIENT_MARKERS:
+            if keyword in text.lower():
+                rest = text[text.lower().find(keyword) + len(keyword):].lstrip(' :')
+                end = re.search(r"[.?!](\s|$)|\n", rest)
+                return rest[:end.start()] if end else rest
+        return None
+
+    def scan_profile(message):
+        message_lower = message.lower()
+        age = re.search(r'(\d+)\s*(years?|year|yaş|yaşındayım)', message_lower)
+        return (int(age.group(1)) if age else None,
+                '6-month' in message_lower or '6 month' in message_lower,
+                tuple(c for c, terms in MEDICAL_KEYWORDS.items() if any(w in message_lower for w in terms)))
+
+    def scan(message):
+        message_lower = message.lower()
+        baby_age = re.search(r'(\d+)\s*(month|months|monthly|mo)', message)
+        age, six_months, conditions = scan_profile(message)
+        return {
+            'tools': scan_tools(message),
+            'symptom': any(word in message_lower for word in SYMPTOM_TERMS),
+            'keywords': scan_keywords(message),
+            'problem_type': scan_groups(message, PROBLEM_TYPES, 'general_health'),
+            'prompt_type': scan_groups(message, PROMPT_TYPES, 'health_advice'),
+            'product_type': scan_product_type(message),
+            'ingredients': scan_ingredients(message),
+            'baby_age': int(baby_age.group(1)) if baby_age else 6,
+            'age': age,
+            'six_months': six_months,
+            'conditions': conditions
+        }
+
+    templates = [
+        "Can I give egg to my {n}-month-old baby?",
+        "What foods should I avoid during pregnancy? I have {cond}.",
+        "Is this product safe for lactose intolerance? It contains milk, sugar and E471.",
+        "How to introduce solid foods to my baby at {n} months?",
+        "What are common food allergies in children?",
+        "I feel bad after eating bread, bloating and stomach pain every day",
+        "Another brand of yogurt, is it healthy for someone with heart disease and blood pressure?",
+        "Bebeğim {n} aylık, çocuk maması verebilir miyim? Şeker var mı?",
+        "I'm {n} years old with diabetes, which cereal or snack is the least risky?",
+        "ingredients: wheat flour, palm oil, hazelnut (13%), cocoa. Similar products for celiac?",
+        "My toddler has a nut allergy, are these cookies made with peanuts dangerous?",
+        "vegan protein drink recommendations for sport and exercise",
+        "hi",
+        "thanks!",
+    ]
+    conditions = ['diabetes', 'celiac disease', 'a gluten sensitivity', 'high cholesterol', 'alerji']
+    rng = random.Random(0)
+
+    def message():
+        text = rng.choice(templates).format(n=rng.randint(1, 40), cond=rng.choice(conditions))
+        return text.upper() if rng.random() < 0.1 else text
+
+    short = [message() for _ in range(20000)]
+    # Pasted label text and multi-question messages
+    long = [" ".join(message() for _ in range(rng.randint(5, 15))) for _ in range(2000)]
+
+    for text in short + long:
+        expected = scan(text)
+        assert detect(text) == expected, (text, expected, detect(text))
+    print(f"Same routing decisions on {len(short) + len(long):,} messages")
+
+    for name, corpus in [("short", short), ("long", long)]:
+        start = time.perf_counter()
+        for text in corpus:
+            scan(text)
+        scan_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for text in corpus:
+            detect.__wrapped__(text)
+        detect_seconds = time.perf_counter() - start
+        print(f"{name:5s} messages: separate scans {scan_seconds / len(corpus) * 1e6:6.1f} us, "
+              f"single pass {detect_seconds / len(corpus) * 1e6:6.1f} us")
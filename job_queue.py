@@ -0,0 +1,221 @@
+# job_queue.py
+# SQLite-backed queue of product analyses. Jobs outlive Streamlit reruns and app restarts,
+# the UI polls their per-stage progress, and the same photo with the same diets is one job.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from llm_scheduler import llm_context
+
+STAGES = ['vision', 'search', 'analysis']
+# A running job whose owner has not sent a heartbeat for this long is taken over
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 10
+# Finished jobs keep their result; the uploaded image is only needed while the job can run
+IMAGE_RETENTION_SECONDS = 24 * 3600
+
+
+class JobQueue:
+    def __init__(self, coordinator, db_path="nutriverse_jobs.db", image_dir="job_images", workers=2,
+                 poll_interval=0.5):
+        self.coordinator = coordinator
+        self.db_path = db_path
+        self.image_dir = image_dir
+        self.poll_interval = poll_interval
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        # Identifies this process's workers in the lease columns
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.running_jobs = set()
+        self.running_lock = threading.Lock()
+        os.makedirs(image_dir, exist_ok=True)
+        self.setup_database()
+        self.workers = [threading.Thread(target=self.worker_loop, name=f"job-worker-{i}", daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self.heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+    def connection(self):
+        # sqlite3 connections cannot be shared between threads
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self.local.conn.row_factory = sqlite3.Row
+            self.local.conn.execute("PRAGMA journal_mode=WAL")
+        return self.local.conn
+
+    def setup_database(self):
+        conn = self.connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                image_path TEXT NOT NULL,
+                preferences TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                heartbeat REAL
+            )""")
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in [('owner', 'TEXT'), ('heartbeat', 'REAL')]:
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def submit(self, image_bytes, user_preferences):
+        """Returns the job id; an existing queued, running or finished job for the same input is reused"""
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        preferences = sorted(user_preferences)
+        job_id = hashlib.sha256(f"{image_hash}:{','.join(preferences)}".encode()).hexdigest()[:32]
+        image_path = os.path.join(self.image_dir, f"{image_hash}.jpg")
+        if not os.path.exists(image_path):
+            with open(image_path, 'wb') as f:
+                f.write(image_bytes)
+
+        now = time.time()
+        progress = {'stages': {stage: 'pending' for stage in STAGES},
+                    'diets': {diet: 'pending' for diet in preferences}}
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            # A finished scan where some diets could not be analyzed runs again on resubmit
+            incomplete = row is not None and row['status'] == 'done' and bool(
+                json.loads(row['result'] or '{}').get('failed_diets'))
+            if row is None:
+                conn.execute("INSERT INTO jobs VALUES (?, ?, ?, 'queued', NULL, ?, NULL, NULL, ?, ?, NULL, NULL)",
+                             (job_id, image_path, json.dumps(preferences), json.dumps(progress), now, now))
+            elif row['status'] == 'failed' or incomplete:
+                conn.execute("UPDATE jobs SET status = 'queued', stage = NULL, progress = ?, error = NULL, "
+                             "updated_at = ? WHERE id = ?", (json.dumps(progress), now, job_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.wakeup.set()
+        return job_id
+
+    def get_job(self, job_id):
+        row = self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row['id'],
+            'status': row['status'],
+            'stage': row['stage'],
+            'preferences': json.loads(row['preferences']),
+            'progress': json.loads(row['progress']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+
+    def claim_next(self):
+        conn = self.connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Running jobs are only taken over once their owner stopped renewing the lease,
+            # i.e. the process that ran them has died
+            row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND "
+                               "(heartbeat IS NULL OR heartbeat < ?)) ORDER BY created_at LIMIT 1",
+                               (now - LEASE_SECONDS,)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, updated_at = ? "
+                             "WHERE id = ?", (self.owner, now, now, row['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get_job(row['id']) if row else None
+
+    def heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self.running_lock:
+                job_ids = list(self.running_jobs)
+            try:
+                for job_id in job_ids:
+                    self.connection().execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ?",
+                                              (time.time(), job_id, self.owner))
+                self.remove_old_images()
+            except (sqlite3.Error, OSError) as e:
+                print(f"Job queue heartbeat error: {str(e)}")
+
+    def remove_old_images(self):
+        """Deletes images of jobs that finished more than IMAGE_RETENTION_SECONDS ago"""
+        rows = self.connection().execute(
+            "SELECT image_path FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ? AND image_path NOT IN "
+            "(SELECT image_path FROM jobs WHERE status IN ('queued', 'running'))",
+            (time.time() - IMAGE_RETENTION_SECONDS,)).fetchall()
+        for row in rows:
+            if os.path.exists(row['image_path']):
+                os.remove(row['image_path'])
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self.connection().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def run_job(self, job):
+        progress = job['progress']
+
+        def report(stage, detail=None):
+            progress['stages'][stage] = 'done'
+            if stage == 'analysis':
+                progress['diets'][detail] = 'done'
+                if any(state == 'pending' for state in progress['diets'].values()):
+                    progress['stages'][stage] = 'running'
+            next_stage = next((s for s in STAGES if progress['stages'][s] != 'done'), None)
+            if next_stage and progress['stages'][next_stage] == 'pending':
+                progress['stages'][next_stage] = 'running'
+            self.update(job['id'], stage=next_stage, progress=json.dumps(progress))
+
+        progress['stages']['vision'] = 'running'
+        self.update(job['id'], stage='vision', progress=json.dumps(progress))
+        with self.running_lock:
+            self.running_jobs.add(job['id'])
+        try:
+            with llm_context('scan', job['id']):
+                result = self.coordinator.full_analysis(self.image_path(job['id']), job['preferences'], report)
+            status = 'failed' if 'error' in result else 'done'
+            self.update(job['id'], status=status, stage=None, result=json.dumps(result, ensure_ascii=False),
+                        error=result.get('error'))
+        except Exception as e:
+            self.update(job['id'], status='failed', error=str(e))
+        finally:
+            with self.running_lock:
+                self.running_jobs.discard(job['id'])
+
+    def image_path(self, job_id):
+        return self.connection().execute("SELECT image_path FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+    def worker_loop(self):
+        while True:
+            try:
+                job = self.claim_next()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {str(e)}")
+                job = None
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+            try:
+                self.run_job(job)
+            except Exception as e:
+                # The lease expires and another worker retries the job
+                print(f"Job {job['id']} could not be recorded: {str(e)}")
+
+    def get_stats(self):
+        rows = self.connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
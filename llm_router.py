@@ -0,0 +1,224 @@
+# llm_router.py
+# Spreads Ollama calls over several hosts: least outstanding requests first, a per-host
+# concurrency limit, and hosts that fail are taken out until a health check passes again.
+#
+#   OLLAMA_HOSTS=http://gpu1:11434,http://gpu2:11434 streamlit run NutriVerse.py
+#   python llm_router.py          # demo against local stub servers
+import os
+import threading
+import time
+import httpx
+import ollama
+
+DEFAULT_HOST = "http://localhost:11434"
+
+
+class OllamaHost:
+    def __init__(self, url, max_concurrency=2, timeout=120):
+        self.url = url
+        self.client = ollama.Client(host=url, timeout=timeout)
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    def load(self):
+        return self.outstanding / self.max_concurrency
+
+
+class OllamaRouter:
+    """Drop-in for the ollama module: chat, generate and ps, routed across hosts"""
+
+    def __init__(self, hosts=None, max_concurrency=2, max_failures=3, health_interval=10, timeout=120):
+        hosts = hosts or [DEFAULT_HOST]
+        self.hosts = [OllamaHost(url, max_concurrency, timeout) for url in hosts]
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self.condition = threading.Condition()
+        if health_interval:
+            threading.Thread(target=self.health_loop, daemon=True).start()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        hosts = [url.strip() for url in os.environ.get("OLLAMA_HOSTS", "").split(",") if url.strip()]
+        concurrency = int(os.environ.get("OLLAMA_HOST_CONCURRENCY", "2"))
+        return cls(hosts or None, max_concurrency=concurrency, **kwargs)
+
+    def acquire(self, exclude=()):
+        """Blocks until a healthy host has a free slot and reserves it"""
+        with self.condition:
+            while True:
+                candidates = [host for host in self.hosts if host.healthy and host not in exclude]
+                if not candidates:
+                    raise ConnectionError("No healthy Ollama host available")
+                host = min(candidates, key=OllamaHost.load)
+                if host.slots.acquire(blocking=False):
+                    host.outstanding += 1
+                    return host
+                self.condition.wait(timeout=1)
+
+    def release(self, host, busy_seconds=0.0, succeeded=False):
+        with self.condition:
+            host.requests += 1
+            host.busy_seconds += busy_seconds
+            if succeeded:
+                host.failures = 0
+            host.outstanding -= 1
+            host.slots.release()
+            self.condition.notify_all()
+
+    def record_failure(self, host, error):
+        with self.condition:
+            host.errors += 1
+            host.failures += 1
+            if host.failures >= self.max_failures and host.healthy:
+                host.healthy = False
+                print(f"Ollama host {host.url} marked down: {str(error)}")
+            self.condition.notify_all()
+
+    def call(self, method, **kwargs):
+        tried = []
+        while True:
+            host = self.acquire(exclude=tried)
+            start = time.perf_counter()
+            succeeded = False
+            try:
+                response = getattr(host.client, method)(**kwargs)
+                succeeded = True
+                return response
+            except ollama.ResponseError as e:
+                # 4xx (unknown model, bad request) would fail the same way on every host
+                if e.status_code < 500:
+                    raise
+                self.record_failure(host, e)
+                error = e
+            except (ConnectionError, OSError, httpx.TransportError) as e:
+                # TransportError covers timeouts, the usual way an overloaded host fails
+                self.record_failure(host, e)
+                error = e
+            finally:
+                self.release(host, time.perf_counter() - start, succeeded)
+            tried.append(host)
+            if len(tried) == len(self.hosts):
+                raise error
+
+    def chat(self, **kwargs):
+        return self.call('chat', **kwargs)
+
+    def generate(self, **kwargs):
+        if not kwargs.get('prompt'):
+            # An empty prompt only loads a model / sets keep_alive, which every host needs
+            return self.broadcast('generate', **kwargs)
+        return self.call('generate', **kwargs)
+
+    def broadcast(self, method, **kwargs):
+        response = None
+        for host in self.hosts:
+            if not host.healthy:
+                continue
+            try:
+                response = getattr(host.client, method)(**kwargs)
+            except Exception as e:
+                self.record_failure(host, e)
+        if response is None:
+            raise ConnectionError("No healthy Ollama host available")
+        return response
+
+    def ps(self):
+        """Models resident on any healthy host"""
+        models = []
+        for host in self.hosts:
+            if host.healthy:
+                try:
+                    models.extend(host.client.ps()['models'])
+                except Exception as e:
+                    self.record_failure(host, e)
+        return {'models': models}
+
+    def check_health(self):
+        for host in self.hosts:
+            try:
+                host.client.list()
+                with self.condition:
+                    if not host.healthy:
+                        print(f"Ollama host {host.url} is back up")
+                    host.healthy = True
+                    host.failures = 0
+                    self.condition.notify_all()
+            except Exception as e:
+                with self.condition:
+                    if host.healthy:
+                        print(f"Ollama host {host.url} marked down: {str(e)}")
+                    host.healthy = False
+
+    def health_loop(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    def get_stats(self):
+        return {host.url: {
+            'healthy': host.healthy,
+            'outstanding': host.outstanding,
+            'requests': host.requests,
+            'errors': host.errors,
+            'busy_seconds': round(host.busy_seconds, 3)
+        } for host in self.hosts}
+
+
+if __name__ == "__main__":
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    def stub_server(delay, fail=False):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, status=200):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if fail:
+                    return self.reply({'error': 'down'}, 503)
+                self.reply({'models': []})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if fail:
+                    return self.reply({'error': 'overloaded'}, 503)
+                time.sleep(delay)
+                port = self.server.server_address[1]
+                if self.path == '/api/chat':
+                    self.reply({'model': request['model'], 'done': True,
+                                'message': {'role': 'assistant', 'content': f"stub {port}"}})
+                else:
+                    self.reply({'model': request['model'], 'done': True, 'response': f"stub {port}"})
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    hosts = [stub_server(0.05), stub_server(0.2), stub_server(0.05, fail=True)]
+    router = OllamaRouter(hosts, max_concurrency=2, health_interval=0)
+
+    def ask(i):
+        return router.chat(model="llama3.2:3b", messages=[{'role': 'user', 'content': str(i)}])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        answers = list(executor.map(ask, range(40)))
+    print(f"40 requests in {time.perf_counter() - start:.2f}s across {len(hosts)} hosts")
+    print(json.dumps(router.get_stats(), indent=2))
+    router.check_health()
+    print({url: stats['healthy'] for url, stats in router.get_stats().items()})
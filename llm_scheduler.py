@@ -0,0 +1,124 @@
+# llm_scheduler.py
+# Orders LLM calls when Ollama capacity is short: chat before scans before batch work,
+# round-robin between users inside a class, and a cap on how many slots batch may hold.
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+PRIORITIES = ['chat', 'scan', 'batch']
+
+# Set by the entry points (chat turn, product scan, offline job); unlabelled calls count as scans
+current_priority = contextvars.ContextVar('llm_priority', default='scan')
+current_user = contextvars.ContextVar('llm_user', default=None)
+
+
+@contextmanager
+def llm_context(priority, user=None):
+    priority_token = current_priority.set(priority)
+    user_token = current_user.set(user)
+    try:
+        yield
+    finally:
+        current_priority.reset(priority_token)
+        current_user.reset(user_token)
+
+
+class LLMScheduler:
+    def __init__(self, capacity=None, batch_limit=None):
+        # Requests Ollama runs in parallel; more would only queue inside Ollama, unordered
+        self.capacity = capacity or int(os.environ.get("OLLAMA_NUM_PARALLEL", "2"))
+        # With two or more slots batch never takes the last one. With a single slot batch only
+        # gets it while no chat or scan call is waiting, so a chat turn waits for at most one batch call
+        self.batch_limit = batch_limit if batch_limit is not None else max(1, self.capacity - 1)
+        self.condition = threading.Condition()
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self.running = {priority: 0 for priority in PRIORITIES}
+        self.waits = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+
+    def next_ticket(self):
+        if sum(self.running.values()) >= self.capacity:
+            return None
+        for priority in PRIORITIES:
+            if priority == 'batch' and self.running['batch'] >= self.batch_limit:
+                continue
+            queue = self.queues[priority]
+            if queue:
+                # Users take turns: the oldest waiting user in the class goes first
+                return next(iter(queue.values()))[0]
+        return None
+
+    def acquire(self):
+        priority = current_priority.get()
+        if priority not in self.queues:
+            priority = 'scan'
+        user = current_user.get()
+        ticket = object()
+        start = time.perf_counter()
+        with self.condition:
+            queue = self.queues[priority]
+            queue.setdefault(user, deque()).append(ticket)
+            while self.next_ticket() is not ticket:
+                self.condition.wait()
+            queue[user].popleft()
+            if queue[user]:
+                queue.move_to_end(user)
+            else:
+                del queue[user]
+            self.running[priority] += 1
+            self.waits[priority].append(time.perf_counter() - start)
+            # Another slot may still be free for the next ticket
+            self.condition.notify_all()
+        return priority
+
+    def release(self, priority):
+        with self.condition:
+            self.running[priority] -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        priority = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def get_stats(self):
+        with self.condition:
+            stats = {}
+            for priority in PRIORITIES:
+                waits = sorted(self.waits[priority])
+                stats[priority] = {
+                    'running': self.running[priority],
+                    'waiting': sum(len(tickets) for tickets in self.queues[priority].values()),
+                    'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+                    'wait_p99': waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0
+                }
+            return stats
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    scheduler = LLMScheduler(capacity=2)
+
+    def fake_llm_call(priority, user, seconds):
+        with llm_context(priority, user):
+            with scheduler.slot():
+                time.sleep(seconds)
+
+    # 200 batch calls flood the queue, then chat and scan traffic arrives
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        for i in range(200):
+            executor.submit(fake_llm_call, 'batch', 'rescoring', 0.02)
+        time.sleep(0.1)
+        for i in range(40):
+            executor.submit(fake_llm_call, 'chat', f"user{i % 4}", 0.02)
+            executor.submit(fake_llm_call, 'scan', f"user{i % 8}", 0.02)
+            time.sleep(0.01)
+
+    for priority, stats in scheduler.get_stats().items():
+        print(f"{priority:6s} wait p50 {stats['wait_p50'] * 1000:7.1f} ms   p99 {stats['wait_p99'] * 1000:7.1f} ms")
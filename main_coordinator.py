@@ -6,38 +6,170 @@ Created on Sat Oct 25 04:08:25 2025
 """
 
 # main_coordinator.py
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from vision_agent import VisionAgent
 from search_agent import SearchAgent
 from rag_agent import RAGAnalysisAgent
+from ingredient_parser import ingredient_ids, normalize_text
+from risk_scoring import classify_safety
+from model_manager import get_model_manager
+from singleflight import get_flight, coalescing_stats
+
+# Longest a scan waits for a prefetched lookup before searching by the detected brand
+PREFETCH_WAIT_SECONDS = 15
 
 class ProductAnalysisCoordinator:
-    def __init__(self):
-        self.vision_agent = VisionAgent()
+    def __init__(self, embedding_backend="torch", embedding_threads=None, hazard_matrix_path=None,
+                 warm_up_models=True):
+        self.model_manager = get_model_manager()
+        if warm_up_models:
+            self.model_manager.warm_up()
+        self.vision_agent = VisionAgent(model_manager=self.model_manager)
         self.search_agent = SearchAgent()
-        self.rag_agent = RAGAnalysisAgent("C:/Users/Tugce/OneDrive/Masaüstü/hazard_ingredients_short.docx")
+        self.rag_agent = RAGAnalysisAgent("C:/Users/Tugce/OneDrive/Masaüstü/hazard_ingredients_short.docx",
+                                          embedding_backend=embedding_backend,
+                                          embedding_threads=embedding_threads,
+                                          hazard_matrix_path=hazard_matrix_path,
+                                          model_manager=self.model_manager)
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+        # Retrieval warm-ups are best effort and must not queue ahead of other scans' lookups
+        self.warmup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="warmup")
+        self.scan_flight = get_flight("full_analysis")
+        self.product_flight = get_flight("analyze_product")
+    
+    def start_prefetch(self, image_path, user_preferences):
+        """Work that does not need the vision result, started while llava runs"""
+        for diet in user_preferences:
+            # Warms the embedding cache for the retrieval analyze_with_llm will do
+            self.warmup_executor.submit(self.rag_agent.extract_diet_info, diet)
+        
+        def prefetch_barcode():
+            for barcode in self.vision_agent.read_barcodes(image_path):
+                product = self.search_agent.search_by_barcode(barcode)
+                if "error" not in product:
+                    return product
+            return None
+        
+        def prefetch_candidates():
+            return {candidate: self.prefetch_executor.submit(self.search_agent.search_product, candidate)
+                    for candidate in self.vision_agent.ocr_brand_candidates(image_path)}
+        
+        return self.prefetch_executor.submit(prefetch_barcode), self.prefetch_executor.submit(prefetch_candidates)
+    
+    def brands_match(self, a, b):
+        a = re.sub(r'[^a-z0-9]', '', normalize_text(a))
+        b = re.sub(r'[^a-z0-9]', '', normalize_text(b))
+        return bool(a) and bool(b) and (a == b or (min(len(a), len(b)) >= 3 and (a in b or b in a)))
+    
+    def cancel_candidates(self, candidates_future):
+        """Drops the candidate searches, including ones the prefetch starts after this call"""
+        def cancel_searches(future):
+            if not future.cancelled() and future.exception() is None:
+                for search in future.result().values():
+                    search.cancel()
+        if not candidates_future.cancel():
+            candidates_future.add_done_callback(cancel_searches)
+    
+    def resolve_product(self, brand, barcode_future, candidates_future):
+        """Uses a prefetched product that matches the detected brand, cancelling the rest"""
+        vision_failed = "UNKNOWN" in brand or "Hata" in brand
+        
+        def barcode_match(wait):
+            try:
+                product = barcode_future.result(timeout=wait)
+            except FutureTimeout:
+                return None
+            if product and (vision_failed or self.brands_match(brand, product['brand'])):
+                return product
+            return None
+        
+        # A finished barcode lookup is the most exact answer
+        barcode_product = barcode_match(0) if barcode_future.done() else None
+        if barcode_product or vision_failed:
+            # Candidates are OCR guesses at the brand, useless without a detected brand to match
+            self.cancel_candidates(candidates_future)
+        if barcode_product:
+            return barcode_product
+        
+        if not vision_failed and not candidates_future.cancel():
+            try:
+                candidates = candidates_future.result(timeout=PREFETCH_WAIT_SECONDS)
+            except FutureTimeout:
+                self.cancel_candidates(candidates_future)
+                candidates = {}
+            product_data = None
+            for candidate, future in candidates.items():
+                if product_data is None and self.brands_match(brand, candidate):
+                    try:
+                        product_data = future.result(timeout=PREFETCH_WAIT_SECONDS)
+                    except FutureTimeout:
+                        product_data = None
+                else:
+                    future.cancel()
+            if product_data is not None and "error" not in product_data:
+                # The brand is resolved; the barcode lookup is not waited for
+                return product_data
+        
+        barcode_product = barcode_match(PREFETCH_WAIT_SECONDS)
+        if barcode_product:
+            return barcode_product
+        if vision_failed:
+            return {"error": "Marka tespit edilemedi"}
+        return self.search_agent.search_product(brand)
+    
+    def full_analysis(self, image_path, user_preferences, progress=None):
+        """progress(stage, detail) is called as vision, search and each diet's analysis finish"""
+        # The same photo uploaded again while it is still being analyzed joins that analysis
+        with open(image_path, 'rb') as f:
+            image_hash = hashlib.sha256(f.read()).hexdigest()
+        key = (image_hash, tuple(sorted(user_preferences)))
+        # A duplicate scan that joins also follows the running scan's stages
+        return self.scan_flight.do_with_progress(key, progress, self.run_full_analysis, image_path, user_preferences)
     
-    def full_analysis(self, image_path, user_preferences):
+    def run_full_analysis(self, image_path, user_preferences, progress=None):
+        progress = progress or (lambda stage, detail=None: None)
         print(" 3-AJANLI ANALİZ BAŞLATILDI")
+        barcode_future, candidates_future = self.start_prefetch(image_path, user_preferences)
         brand = self.vision_agent.detect_brand(image_path)
         print(f"Tespit edilen marka: {brand}")
+        progress('vision', brand)
         
-        if "UNKNOWN" in brand or "Hata" in brand:
-            return {"error": "Marka tespit edilemedi"}
-        product_data = self.search_agent.search_product(brand)
-        
+        product_data = self.resolve_product(brand, barcode_future, candidates_future)
         if "error" in product_data:
-            return {"error": "Ürün bulunamadı"}
+            return {"error": product_data["error"] if "Marka" in product_data["error"] else "Ürün bulunamadı"}
+        if "UNKNOWN" in brand or "Hata" in brand:
+            brand = product_data['brand']
+        progress('search', product_data.get('product_name'))
         
 
+        return {'brand': brand, **self.analyze_product(product_data, user_preferences, progress)}
+    
+    def analyze_product(self, product_data, user_preferences, progress=None):
+        # Different photos of the same product resolve to the same ingredient list
         ingredients = product_data.get('ingredients', '')
-        risk_analysis = self.rag_agent.analyze_ingredients(ingredients, user_preferences)
+        key = (product_data.get('product_name'), ingredients, tuple(sorted(user_preferences)))
+        return self.product_flight.do_with_progress(key, progress, self.run_product_analysis,
+                                                    product_data, user_preferences)
+    
+    def run_product_analysis(self, product_data, user_preferences, progress=None):
+        ingredients = product_data.get('ingredients', '')
+        risk_analysis = self.rag_agent.analyze_ingredients(ingredients, user_preferences, progress)
         risk_score = self.rag_agent.calculate_risk_score(risk_analysis)
+        failed_diets = [diet for diet, result in risk_analysis.items() if result.get('error')]
+        complete = len(failed_diets) < len(risk_analysis)
         
         return {
-            'brand': brand,
             'product_name': product_data.get('product_name'),
             'ingredients': ingredients,
+            'ingredient_ids': sorted(ingredient_ids(ingredients)),
             'risk_analysis': risk_analysis,
             'risk_score': risk_score,
-            'overall_safety': "GÜVENLİ" if risk_score > 80 else "ORTA" if risk_score > 50 else "RİSKLİ"
-        }
\ No newline at end of file
+            'overall_safety': classify_safety(risk_score) if complete else "BİLİNMİYOR",
+            # The score only covers the other diets; re-submitting the scan retries these
+            'failed_diets': failed_diets
+        }
+    
+    def get_coalescing_stats(self):
+        return coalescing_stats()
\ No newline at end of file
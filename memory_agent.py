@@ -2,13 +2,25 @@
 import json
 from datetime import datetime, timedelta
 import hashlib
+from contextlib import contextmanager
+from session_store import make_session_store
+
+# Most recently joined members of a segment compared per similar-users / insights query
+MAX_SEGMENT_SCAN = 500
+CARD_RECOMMENDATIONS = 10
 
 class MemoryAgent:
     def __init__(self):
-        self.user_profiles = {}
-        self.user_segments = {}
+        # Shared with other app processes when NUTRIVERSE_SESSION_STORE is set
+        self.user_profiles = make_session_store("memory_profiles")
+        # segment -> user ids, and user id -> the few profile fields other users are compared on,
+        # so community queries never load anyone's full profile and analysis history
+        self.user_segments = make_session_store("memory_segments")
+        self.user_cards = make_session_store("memory_cards")
         self.anonymized_data = {}
         self.initialize_default_segments()
+        if not self.user_segments.items():
+            self.rebuild_segment_index()
     
     def initialize_default_segments(self):
         self.segment_definitions = {
@@ -42,32 +54,77 @@ class MemoryAgent:
             }
         }
     
+    def new_user_profile(self):
+        return {
+            'segment': 'general_health',
+            'age_group': 'adult',
+            'medical_conditions': [],
+            'allergies': [],
+            'diet_preferences': [],
+            'has_children': False,
+            'baby_age_months': None,
+            'previous_analyses': [],
+            'chat_interactions': 0,
+            'common_complaints': [],
+            'successful_recommendations': [],
+            'created_at': datetime.now().isoformat(),
+            'last_active': datetime.now().isoformat()
+        }
+    
+    @contextmanager
+    def edit_user_profile(self, user_id):
+        """The profile under the user's lock; changes are saved when the block exits"""
+        with self.user_profiles.edit(user_id, self.new_user_profile) as profile:
+            if profile['chat_interactions'] == 0:
+                self.assign_user_segment(user_id, profile)
+            profile['last_active'] = datetime.now().isoformat()
+            profile['chat_interactions'] += 1
+            card = self.user_card(profile)
+            yield profile
+            if self.user_card(profile) != card:
+                self.user_cards.set(user_id, self.user_card(profile))
+    
+    def user_card(self, profile):
+        return {
+            'segment': profile['segment'],
+            'age_group': profile['age_group'],
+            'medical_conditions': list(profile['medical_conditions']),
+            'diet_preferences': list(profile['diet_preferences']),
+            'common_complaints': list(profile.get('common_complaints', [])),
+            'successful_recommendations': [rec.get('recommendation', '') if isinstance(rec, dict) else rec
+                                           for rec in profile.get('successful_recommendations', [])
+                                           ][-CARD_RECOMMENDATIONS:]
+        }
+    
+    def rebuild_segment_index(self):
+        """One full scan for profiles stored before the segment index existed"""
+        members = {}
+        for user_id, profile in self.user_profiles.items():
+            members.setdefault(profile['segment'], []).append(user_id)
+            self.user_cards.set(user_id, self.user_card(profile))
+        for segment, user_ids in members.items():
+            self.user_segments.set(segment, user_ids)
+    
+    def segment_cards(self, segment):
+        cards = []
+        for user_id in self.user_segments.get(segment, [])[-MAX_SEGMENT_SCAN:]:
+            card = self.user_cards.get(user_id)
+            if card is not None and card['segment'] == segment:
+                cards.append((user_id, card))
+        return cards
+    
     def get_or_create_user_profile(self, user_id):
-        if user_id not in self.user_profiles:
-            self.user_profiles[user_id] = {
-                'segment': 'general_health',
-                'age_group': 'adult',
-                'medical_conditions': [],
-                'allergies': [],
-                'diet_preferences': [],
-                'has_children': False,
-                'baby_age_months': None,
-                'previous_analyses': [],
-                'chat_interactions': 0,
-                'common_complaints': [],
-                'successful_recommendations': [],
-                'created_at': datetime.now().isoformat(),
-                'last_active': datetime.now().isoformat()
-            }
-            self.assign_user_segment(user_id)
-        
-        self.user_profiles[user_id]['last_active'] = datetime.now().isoformat()
-        self.user_profiles[user_id]['chat_interactions'] += 1
-        
-        return self.user_profiles[user_id]
+        with self.edit_user_profile(user_id) as profile:
+            return profile
+    
+    def get_user_profile(self, user_id):
+        """Read-only view for display; unlike get_or_create_user_profile it records no activity"""
+        return self.user_profiles.get(user_id) or self.new_user_profile()
     
-    def assign_user_segment(self, user_id):
-        profile = self.user_profiles[user_id]
+    def assign_user_segment(self, user_id, profile=None):
+        if profile is None:
+            with self.user_profiles.edit(user_id, self.new_user_profile) as profile:
+                return self.assign_user_segment(user_id, profile)
         best_segment = 'general_health'
         max_matches = 0
         
@@ -85,55 +142,61 @@ class MemoryAgent:
                 max_matches = condition_matches
                 best_segment = segment_name
         
+        previous = profile['segment']
         profile['segment'] = best_segment
-        self.user_segments[user_id] = best_segment
+        if previous != best_segment:
+            with self.user_segments.edit(previous, list) as members:
+                if user_id in members:
+                    members.remove(user_id)
+        with self.user_segments.edit(best_segment, list) as members:
+            if user_id not in members:
+                members.append(user_id)
+        self.user_cards.set(user_id, self.user_card(profile))
     
     def update_from_chat_interaction(self, user_id, interaction_type, sentiment):
-        profile = self.get_or_create_user_profile(user_id)
-        
-        # Extract potential medical conditions from chat
-        if interaction_type == "symptom_report":
-            if "bloating" in interaction_type.lower() and "bloating" not in profile['common_complaints']:
-                profile['common_complaints'].append("bloating")
-                profile['medical_conditions'].append("digestive_issues")
+        with self.edit_user_profile(user_id) as profile:
+            # Extract potential medical conditions from chat
+            if interaction_type == "symptom_report":
+                if "bloating" in interaction_type.lower() and "bloating" not in profile['common_complaints']:
+                    profile['common_complaints'].append("bloating")
+                    profile['medical_conditions'].append("digestive_issues")
+                
+                if "baby" in interaction_type.lower() and not profile['has_children']:
+                    profile['has_children'] = True
             
-            if "baby" in interaction_type.lower() and not profile['has_children']:
-                profile['has_children'] = True
-        
-        self.assign_user_segment(user_id)
+            self.assign_user_segment(user_id, profile)
     
     def update_user_profile(self, user_id, updates):
-        profile = self.get_or_create_user_profile(user_id)
-        profile.update(updates)
-        self.assign_user_segment(user_id)
+        with self.edit_user_profile(user_id) as profile:
+            profile.update(updates)
+            self.assign_user_segment(user_id, profile)
     
     def add_product_analysis(self, user_id, product_analysis):
-        profile = self.get_or_create_user_profile(user_id)
-        profile['previous_analyses'].append({
-            'timestamp': datetime.now().isoformat(),
-            'product_analysis': product_analysis
-        })
+        with self.edit_user_profile(user_id) as profile:
+            profile['previous_analyses'].append({
+                'timestamp': datetime.now().isoformat(),
+                'product_analysis': product_analysis
+            })
     
     def get_similar_users(self, user_id, max_users=5):
-        if user_id not in self.user_profiles:
+        current_profile = self.user_cards.get(user_id)
+        if current_profile is None:
             return []
         
-        current_profile = self.user_profiles[user_id]
         current_segment = current_profile['segment']
         
         similar_users = []
-        for other_id, profile in self.user_profiles.items():
+        for other_id, profile in self.segment_cards(current_segment):
             if other_id == user_id:
                 continue
-            if profile['segment'] == current_segment:
-                similarity_score = self.calculate_similarity(current_profile, profile)
-                similar_users.append({
-                    'user_id': other_id,
-                    'similarity_score': similarity_score,
-                    'segment': profile['segment'],
-                    'common_conditions': list(set(current_profile['medical_conditions']) & set(profile['medical_conditions'])),
-                    'successful_recommendations': profile.get('successful_recommendations', [])[:3]
-                })
+            similarity_score = self.calculate_similarity(current_profile, profile)
+            similar_users.append({
+                'user_id': other_id,
+                'similarity_score': similarity_score,
+                'segment': profile['segment'],
+                'common_conditions': list(set(current_profile['medical_conditions']) & set(profile['medical_conditions'])),
+                'successful_recommendations': profile['successful_recommendations'][:3]
+            })
         similar_users.sort(key=lambda x: x['similarity_score'], reverse=True)
         return similar_users[:max_users]
     
@@ -155,27 +218,26 @@ class MemoryAgent:
         return min(score, 1.0)
     
     def get_community_insights(self, segment, problem_type):
-        segment_users = [uid for uid, profile in self.user_profiles.items() 
-                        if profile['segment'] == segment]
+        segment_profiles = [card for _, card in self.segment_cards(segment)]
         
-        if not segment_users:
+        if not segment_profiles:
             return f"No community data available for {segment} segment"
         
         insights = {
-            "total_users_in_segment": len(segment_users),
+            "total_users_in_segment": len(segment_profiles),
             "common_complaints": [],
             "successful_solutions": [],
             "segment_description": self.segment_definitions.get(segment, {}).get('description', '')}
         all_complaints = []
-        for uid in segment_users:
-            all_complaints.extend(self.user_profiles[uid].get('common_complaints', []))
+        for profile in segment_profiles:
+            all_complaints.extend(profile.get('common_complaints', []))
         
         from collections import Counter
         common_complaints = Counter(all_complaints).most_common(3)
         insights["common_complaints"] = [complaint for complaint, count in common_complaints]
         all_recommendations = []
-        for uid in segment_users:
-            all_recommendations.extend(self.user_profiles[uid].get('successful_recommendations', []))
+        for profile in segment_profiles:
+            all_recommendations.extend(profile['successful_recommendations'])
         
         common_recommendations = Counter(all_recommendations).most_common(3)
         insights["successful_solutions"] = [solution for solution, count in common_recommendations]
@@ -183,11 +245,11 @@ class MemoryAgent:
         return insights
     
     def add_successful_recommendation(self, user_id, recommendation):
-        profile = self.get_or_create_user_profile(user_id)
-        if 'successful_recommendations' not in profile:
-            profile['successful_recommendations'] = []
-        
-        profile['successful_recommendations'].append({
-            'recommendation': recommendation,
-            'timestamp': datetime.now().isoformat()
-        })
\ No newline at end of file
+        with self.edit_user_profile(user_id) as profile:
+            if 'successful_recommendations' not in profile:
+                profile['successful_recommendations'] = []
+            
+            profile['successful_recommendations'].append({
+                'recommendation': recommendation,
+                'timestamp': datetime.now().isoformat()
+            })
\ No newline at end of file
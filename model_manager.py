@@ -0,0 +1,155 @@
+# model_manager.py
+# Every Ollama call goes through one ModelManager so keep_alive is set consistently,
+# models are loaded before the first user request, and reloads show up in the stats.
+import os
+import threading
+import time
+from collections import Counter, deque
+import ollama
+from llm_router import OllamaRouter
+from llm_scheduler import LLMScheduler
+
+VISION_MODEL = "llava:7b"
+TEXT_MODEL = "llama3.2:3b"
+
+# keep_alive for a model that is not currently the hot one
+MODEL_KEEP_ALIVE = {
+    TEXT_MODEL: "30m",
+    VISION_MODEL: "10m"
+}
+
+# load_duration above this (seconds) means Ollama had to load the weights for the request
+LOAD_THRESHOLD = 0.5
+
+
+class ModelManager:
+    def __init__(self, keep_alive=None, hot_keep_alive=-1, window=50, client=None, scheduler=None):
+        self.keep_alive = dict(MODEL_KEEP_ALIVE, **(keep_alive or {}))
+        # -1 keeps the hot model loaded until the traffic mix moves to another model
+        self.hot_keep_alive = hot_keep_alive
+        self.recent = deque(maxlen=window)
+        self.client = client or ollama
+        # Orders calls by priority class and user once Ollama capacity is used up
+        self.scheduler = scheduler or LLMScheduler()
+        self.lock = threading.Lock()
+        self.hot_model = None
+        self.stats = {}
+
+    def model_stats(self, model):
+        if model not in self.stats:
+            self.stats[model] = {
+                'requests': 0,
+                'loads': 0,
+                'evictions': 0,
+                'load_seconds': 0.0,
+                'last_load': None
+            }
+        return self.stats[model]
+
+    def record_request(self, model):
+        """Updates the traffic mix and returns the keep_alive to send with this request"""
+        with self.lock:
+            self.recent.append(model)
+            self.model_stats(model)['requests'] += 1
+            hot_model = Counter(self.recent).most_common(1)[0][0]
+            previous = self.hot_model
+            self.hot_model = hot_model
+        if previous and previous != hot_model:
+            print(f"Hot model: {previous} -> {hot_model}")
+            threading.Thread(target=self.demote, args=(previous,), daemon=True).start()
+        return self.keep_alive_for(model)
+
+    def demote(self, model):
+        # The old hot model was pinned with keep_alive -1; let it expire normally, but
+        # never reload it just to change keep_alive if Ollama already evicted it
+        if model in self.resident_models():
+            self.set_keep_alive(model, self.keep_alive_for(model))
+
+    def keep_alive_for(self, model):
+        if model == self.hot_model:
+            return self.hot_keep_alive
+        return self.keep_alive.get(model, "5m")
+
+    def record_timings(self, model, response):
+        load_seconds = (response.get('load_duration') or 0) / 1e9
+        if load_seconds < LOAD_THRESHOLD:
+            return
+        with self.lock:
+            stats = self.model_stats(model)
+            # A load after the first one means Ollama evicted the model in between
+            if stats['loads']:
+                stats['evictions'] += 1
+                print(f"{model} was evicted and reloaded ({load_seconds:.1f}s)")
+            stats['loads'] += 1
+            stats['load_seconds'] += load_seconds
+            stats['last_load'] = time.time()
+
+    def chat(self, model, messages, **kwargs):
+        keep_alive = self.record_request(model)
+        with self.scheduler.slot():
+            response = self.client.chat(model=model, messages=messages, keep_alive=keep_alive, **kwargs)
+        self.record_timings(model, response)
+        return response
+
+    def generate(self, model, prompt, **kwargs):
+        keep_alive = self.record_request(model)
+        with self.scheduler.slot():
+            response = self.client.generate(model=model, prompt=prompt, keep_alive=keep_alive, **kwargs)
+        self.record_timings(model, response)
+        return response
+
+    def set_keep_alive(self, model, keep_alive):
+        # An empty prompt only (re)loads the model and updates its keep_alive
+        try:
+            response = self.client.generate(model=model, prompt="", keep_alive=keep_alive)
+            self.record_timings(model, response)
+        except Exception as e:
+            print(f"keep_alive update failed for {model}: {str(e)}")
+
+    def warm_up(self, models=None, background=True):
+        """Loads the models before the first request; the text model last so it stays in memory"""
+        models = models or [VISION_MODEL, TEXT_MODEL]
+
+        def run():
+            for model in models:
+                start = time.perf_counter()
+                self.set_keep_alive(model, self.keep_alive_for(model))
+                print(f"Warmed up {model} in {time.perf_counter() - start:.1f}s")
+
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def resident_models(self):
+        try:
+            return [model['model'] for model in self.client.ps()['models']]
+        except Exception:
+            return []
+
+    def get_stats(self):
+        with self.lock:
+            mix = Counter(self.recent)
+            return {
+                'hot_model': self.hot_model,
+                'traffic_mix': {model: count / len(self.recent) for model, count in mix.items()},
+                'models': {model: dict(stats) for model, stats in self.stats.items()}
+            }
+
+
+shared_manager = None
+shared_manager_lock = threading.Lock()
+
+
+def get_model_manager():
+    """Process-wide manager, so all agents contribute to the same traffic mix"""
+    global shared_manager
+    with shared_manager_lock:
+        if shared_manager is None:
+            # Several Ollama hosts are load balanced by llm_router.py
+            client, capacity = None, None
+            if os.environ.get("OLLAMA_HOSTS"):
+                client = OllamaRouter.from_env()
+                capacity = sum(host.max_concurrency for host in client.hosts)
+            shared_manager = ModelManager(client=client, scheduler=LLMScheduler(capacity))
+        return shared_manager
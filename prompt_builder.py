@@ -0,0 +1,197 @@
+# prompt_builder.py
+import json
+import os
+import textwrap
+
+# Exact token counts are opt-in: the tokenizer is downloaded on startup and needs transformers.
+# NUTRIVERSE_TOKENIZER=unsloth/Llama-3.2-3B-Instruct matches llama3.2 and needs no Hugging Face login;
+# unset, a chars/token estimate calibrated on Ollama's prompt_eval_count is used.
+CHAT_TOKENIZER = os.environ.get("NUTRIVERSE_TOKENIZER") or None
+# Plausible chars/token for llama3.2 on English and Turkish text
+MIN_CHARS_PER_TOKEN = 2.0
+MAX_CHARS_PER_TOKEN = 6.0
+# Tool results in the order the model should weigh them; the profile has its own section
+TOOL_ORDER = ['extract_ingredients_from_image', 'analyze_ingredients', 'calculate_nutrition_risk',
+              'check_baby_safety', 'get_age_specific_advice', 'find_similar_users', 'community_advice',
+              'get_user_profile']
+
+
+class PromptBuilder:
+    """Fills a prompt template while keeping it inside a token budget"""
+
+    def __init__(self, max_tokens=1400, tokenizer_name=None, section_caps=None):
+        # llama3.2 runs with a 2048 token context by default in Ollama and the
+        # chatbot asks for up to 600 generated tokens, so the prompt gets the rest.
+        self.max_tokens = max_tokens
+        self.tokenizer = self.load_tokenizer(tokenizer_name)
+        self.chars_per_token = 4.0
+        self.section_caps = section_caps or {
+            'history': 300,
+            'rag_context': 350,
+            'tools': 350,
+            'community_insights': 120,
+            'similar_users': 150,
+            'profile': 120
+        }
+        # Sections where the newest lines are at the end and must survive truncation
+        self.tail_sections = {'history'}
+        self.last_breakdown = {}
+
+    def load_tokenizer(self, tokenizer_name):
+        if not tokenizer_name:
+            return None
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(tokenizer_name)
+        except Exception as e:
+            print(f"Tokenizer {tokenizer_name} not available, using estimate: {str(e)}")
+            return None
+
+    def count_tokens(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.chars_per_token) + 1
+
+    def calibrate(self, prompt, prompt_eval_count):
+        """Learn the chars/token ratio from the count Ollama reports for a prompt"""
+        if self.tokenizer is not None or not prompt_eval_count:
+            return
+        # With prefix caching Ollama counts only the uncached tail of the prompt
+        if prompt_eval_count < 0.5 * self.count_tokens(prompt):
+            return
+        observed = min(max(len(prompt) / prompt_eval_count, MIN_CHARS_PER_TOKEN), MAX_CHARS_PER_TOKEN)
+        self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * observed
+
+    def truncate(self, text, max_tokens, keep_tail=False):
+        if max_tokens <= 0 or not text:
+            return ""
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        # Sections are ordered by relevance, so keep whole lines from the top
+        lines = text.split("\n")
+        if keep_tail:
+            lines.reverse()
+        kept = []
+        used = 0
+        for line in lines:
+            line_tokens = self.count_tokens(line) + 1
+            if used + line_tokens > max_tokens:
+                if keep_tail:
+                    # Skipping a turn would leave a hole in the conversation
+                    break
+                # A long line must not hide the shorter ones after it
+                continue
+            kept.append(line)
+            used += line_tokens
+        if kept:
+            if keep_tail:
+                kept.reverse()
+            return "\n".join(kept)
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            ids = ids[-max_tokens:] if keep_tail else ids[:max_tokens]
+            # A cut inside a multi-byte character decodes to a replacement char
+            cut = self.tokenizer.decode(ids).strip("\ufffd")
+        else:
+            chars = int(max_tokens * self.chars_per_token)
+            cut = text[-chars:] if keep_tail else text[:chars]
+        # End on a word boundary rather than inside a word
+        if keep_tail:
+            return "... " + (cut.split(" ", 1)[1] if " " in cut else cut)
+        if " " in cut:
+            cut = cut.rsplit(" ", 1)[0]
+        return cut + " ..."
+
+    def build(self, template, fixed, sections, priorities):
+        """
+        fixed: fields that are always included as-is (question, segment)
+        sections: optional fields that may be truncated or dropped
+        priorities: section names, most relevant first
+        """
+        template = textwrap.dedent(template).strip()
+        used_sections = [name for name in priorities if "{" + name + "}" in template]
+        empty = {name: "" for name in sections}
+        base_tokens = self.count_tokens(template.format(**fixed, **empty))
+
+        remaining = self.max_tokens - base_tokens
+        filled = {}
+        breakdown = {'base': base_tokens}
+        for name in used_sections:
+            text = sections.get(name) or ""
+            allowed = min(remaining, self.section_caps.get(name, remaining))
+            filled[name] = self.truncate(text, allowed, keep_tail=name in self.tail_sections)
+            breakdown[name] = self.count_tokens(filled[name])
+            remaining -= breakdown[name]
+
+        prompt = template.format(**fixed, **{**empty, **filled})
+        breakdown['total'] = self.count_tokens(prompt)
+        self.last_breakdown = breakdown
+        return prompt
+
+    def get_breakdown(self):
+        return dict(self.last_breakdown)
+
+
+def compact_profile(profile):
+    if not profile:
+        return "Unknown"
+    fields = [
+        ('segment', 'segment'),
+        ('age_group', 'age'),
+        ('medical_conditions', 'conditions'),
+        ('allergies', 'allergies'),
+        ('diet_preferences', 'diets'),
+        ('has_children', 'children'),
+        ('baby_age_months', 'baby_months'),
+        ('common_complaints', 'complaints')
+    ]
+    parts = []
+    for key, label in fields:
+        value = profile.get(key)
+        if value in (None, [], '', False):
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = ",".join(str(v) for v in value)
+        parts.append(f"{label}={value}")
+    return "; ".join(parts) if parts else "No profile details"
+
+
+def compact_insights(insights):
+    if not isinstance(insights, dict):
+        return str(insights)
+    parts = [f"users={insights.get('total_users_in_segment', 0)}"]
+    if insights.get('segment_description'):
+        parts.append(insights['segment_description'])
+    if insights.get('common_complaints'):
+        parts.append("complaints=" + ",".join(str(c) for c in insights['common_complaints']))
+    if insights.get('successful_solutions'):
+        parts.append("solutions=" + ",".join(str(s) for s in insights['successful_solutions']))
+    return "; ".join(parts)
+
+
+def compact_similar_users(similar_users):
+    if not similar_users:
+        return "None found"
+    lines = []
+    for user in similar_users:
+        line = f"{user.get('segment', '')} user, similarity {user.get('similarity_score', 0):.2f}"
+        if user.get('common_conditions'):
+            line += ", shared: " + ",".join(user['common_conditions'])
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_tool_results(tool_results):
+    lines = []
+    ordered = sorted(tool_results, key=lambda tool: TOOL_ORDER.index(tool) if tool in TOOL_ORDER else len(TOOL_ORDER))
+    for tool in ordered:
+        result = tool_results[tool]
+        if tool == "get_user_profile":
+            # The raw profile carries every past analysis
+            result = compact_profile(result)
+        elif isinstance(result, (dict, list)):
+            result = json.dumps(result, separators=(',', ':'), ensure_ascii=False, default=str)
+        lines.append(f"{tool}: {result}")
+    return "\n".join(lines)
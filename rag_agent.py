@@ -4,35 +4,162 @@ Created on Sat Oct 25 04:08:03 2025
 @author: Tugce
 """
 
-import docx
-from langchain.llms import Ollama
-from langchain.chains import LLMChain
+import json
+import os
+import threading
+import time
+import numpy as np
 from langchain.prompts import PromptTemplate
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.schema import Document
+from model_manager import get_model_manager
+from singleflight import get_flight
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_backends import make_embeddings
+from ingestion import stream_documents, embed_in_batches
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from ingredient_parser import normalize_text, ingredient_ids, display_name
+from hazard_matrix import HazardMatrix, verdict_to_result, merge_results
+from faiss_index import (build_faiss_index, set_search_params, make_vector_store, recall_at_k,
+                         save_vector_store, load_vector_store)
+
+DIET_QUERIES = {
+    'celiac': "gluten wheat barley rye celiac disease autoimmune",
+    'diabetes': "sugar glucose fructose carbohydrates glycemic insulin",
+    'vegan': "vegan animal milk egg honey gelatin dairy",
+    'vegetarian': "vegetarian meat fish chicken poultry gelatin",
+    'lactose': "lactose milk dairy cheese whey intolerance",
+    'nut_allergy': "nut peanut almond walnut hazelnut allergy anaphylaxis",
+    'soy_allergy': "soy soybean tofu soybeans allergy",
+    'heart_disease': "saturated fat cholesterol sodium salt heart cardiovascular",
+    'hypertension': "sodium salt blood pressure hypertension",
+    'baby_0_6': "infant formula breast milk 0-6 months honey salt sugar",
+    'baby_6_8': "6-8 months puree salt sugar honey egg whites",
+    'baby_8_12': "8-12 months soft foods choking hazards salt sugar"
+}
+
+# Ollama constrains generation to this schema (format=...), so the verdict is read as JSON
+ANALYSIS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'suitable': {'type': 'boolean'},
+        'risk_level': {'type': 'string', 'enum': ['LOW', 'MEDIUM', 'HIGH']},
+        'hazardous_ingredients': {'type': 'array', 'items': {'type': 'string'}},
+        'explanation': {'type': 'string'}
+    },
+    'required': ['suitable', 'risk_level', 'hazardous_ingredients', 'explanation']
+}
+# A verdict and a short explanation fit well inside this
+ANALYSIS_MAX_TOKENS = 300
 
 class RAGAnalysisAgent:
-    def __init__(self, docx_path):
-        self.knowledge_base = ""
+    def __init__(self, source_path, embedding_cache=None, embedding_backend="torch", embedding_threads=None,
+                 index_type="flat", nprobe=16, ef_search=64, index_path=None, ingest_workers=None,
+                 hazard_matrix_path=None, model_manager=None):
+        # A single .docx or a directory of .docx / .pdf / .md / .csv files
+        self.source_path = source_path
+        self.ingest_workers = ingest_workers
+        self.ingestion_stats = {}
+        self.documents = []
+        self.document_vectors = None
         self.vector_store = None
-        self.llm = Ollama(model="llama3.2:3b")
-        self.load_hazard_data_from_docx(docx_path)
+        self.bm25_index = None
+        # flat | ivf_flat | ivf_pq | hnsw, see faiss_index.py
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # Built index is saved here and memory-mapped on later starts; delete it after changing the corpus
+        self.index_path = index_path
+        self.embeddings = None
+        self.embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
+        # torch | torch_int8 | onnx | onnx_int8, see embedding_backends.py
+        self.embedding_backend = embedding_backend
+        self.embedding_threads = embedding_threads
+        self.embedding_cache = embedding_cache or EmbeddingCache()
+        self.llm_model = "llama3.2:3b"
+        self.models = model_manager or get_model_manager()
+        self.llm_flight = get_flight("analyze_with_llm")
+        # How often the model's JSON had to be repaired or was given up on
+        self.format_stats = {'analyses': 0, 'calls': 0, 'invalid': 0, 'repaired': 0, 'failed': 0, 'eval_tokens': 0}
+        self.format_stats_lock = threading.Lock()
+        # Precomputed ingredient x diet verdicts, built offline by hazard_matrix.py
+        self.hazard_matrix = None
+        if hazard_matrix_path and os.path.exists(hazard_matrix_path):
+            self.hazard_matrix = HazardMatrix.load(hazard_matrix_path)
+            print(f"Hazard matrix loaded: {len(self.hazard_matrix.ingredients)} ingredients")
         self.setup_vector_database() 
         self.setup_prompts()
     
     def setup_vector_database(self):
-        text_splitter = CharacterTextSplitter(
-            chunk_size=500,chunk_overlap=50,separator="\n")
+        encoder = make_embeddings(self.embedding_model, self.embedding_backend, self.embedding_threads)
+        # Vectors differ between backends, so they must not share cache entries
+        self.embeddings = CachedEmbeddings(
+            encoder, f"{self.embedding_model}:{self.embedding_backend}", self.embedding_cache)
         
-        texts = text_splitter.split_text(self.knowledge_base)
-        documents = [Document(page_content=text) for text in texts]
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2")
-        self.vector_store = FAISS.from_documents(documents, embeddings)
+        if self.index_path and os.path.exists(os.path.join(self.index_path, "index.faiss")):
+            self.vector_store, self.document_vectors = load_vector_store(self.index_path, self.embeddings, mmap=True)
+            self.documents = [self.vector_store.docstore.search(doc_id)
+                              for doc_id in self.vector_store.index_to_docstore_id.values()]
+            self.tune_search(self.nprobe, self.ef_search)
+            self.build_lexical_index()
+            print(f"Vector database loaded from {self.index_path}!")
+            return
+        
+        self.documents = []
+        vector_batches = []
+        start = time.perf_counter()
+        documents = stream_documents(self.source_path, chunk_size=500, workers=self.ingest_workers)
+        for batch, vectors in embed_in_batches(documents, self.embeddings):
+            self.documents.extend(batch)
+            vector_batches.append(np.array(vectors, dtype=np.float32))
+        elapsed = time.perf_counter() - start
+        if not self.documents:
+            raise ValueError(f"No knowledge base chunks could be ingested from {self.source_path}")
+        self.ingestion_stats = {
+            'sources': len({doc.metadata['source'] for doc in self.documents}),
+            'chunks': len(self.documents),
+            'seconds': elapsed,
+            'chunks_per_second': len(self.documents) / elapsed if elapsed else 0.0
+        }
+        print(f"Ingested {self.ingestion_stats['chunks']} chunks from {self.ingestion_stats['sources']} "
+              f"sources ({self.ingestion_stats['chunks_per_second']:.1f} chunks/s)")
+        
+        self.document_vectors = np.vstack(vector_batches)
+        index = build_faiss_index(self.document_vectors, self.index_type)
+        self.vector_store = make_vector_store(index, self.documents, self.embeddings)
+        self.tune_search(self.nprobe, self.ef_search)
+        if self.index_path:
+            save_vector_store(self.vector_store, self.document_vectors, self.index_path)
+        self.build_lexical_index()
         print("Vector database created!")
     
+    def build_lexical_index(self):
+        # Doc ids match FAISS ids: both follow the order of self.documents
+        self.bm25_index = BM25Index()
+        self.bm25_index.add_documents([doc.page_content for doc in self.documents])
+    
+    def hybrid_search_ids(self, query, k=3, candidates=20):
+        """Vector and BM25 rankings fused with reciprocal-rank fusion"""
+        query_vector = np.array([self.embeddings.embed_query(query)], dtype=np.float32)
+        _, indices = self.vector_store.index.search(query_vector, candidates)
+        vector_ranking = [int(idx) for idx in indices[0] if idx != -1]
+        lexical_ranking = [doc_id for doc_id, _ in self.bm25_index.search(query, candidates)]
+        fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking])
+        return [doc_id for doc_id, _ in fused[:k]]
+    
+    def hybrid_search(self, query, k=3, candidates=20):
+        return [self.documents[doc_id] for doc_id in self.hybrid_search_ids(query, k, candidates)]
+    
+    def tune_search(self, nprobe=None, ef_search=None):
+        """nprobe applies to IVF indexes, ef_search to HNSW"""
+        self.nprobe = nprobe or self.nprobe
+        self.ef_search = ef_search or self.ef_search
+        set_search_params(self.vector_store.index, self.nprobe, self.ef_search)
+    
+    def measure_recall(self, queries=None, k=3):
+        """recall@k of the configured index against exact flat search"""
+        queries = queries or list(DIET_QUERIES.values())
+        query_vectors = np.array(self.embeddings.embed_queries(queries), dtype=np.float32)
+        return recall_at_k(self.vector_store.index, self.document_vectors, query_vectors, k)
+    
     def setup_prompts(self):
         self.analysis_prompt = PromptTemplate(
             input_variables=["ingredients", "diet", "hazard_info"],
@@ -43,11 +170,11 @@ class RAGAnalysisAgent:
             DIETARY REQUIREMENT: {diet}
             HAZARD KNOWLEDGE: {hazard_info}
 
-            Provide analysis in this exact format:
-            SUITABLE: [YES/NO]
-            RISK_LEVEL: [LOW/MEDIUM/HIGH]
-            HAZARDOUS_INGREDIENTS: [comma-separated list or "None"]
-            EXPLANATION: [Clear explanation based on scientific evidence]
+            Answer with a JSON object:
+            "suitable": true or false
+            "risk_level": "LOW", "MEDIUM" or "HIGH"
+            "hazardous_ingredients": list of the ingredients that violate the requirement, empty if none
+            "explanation": clear explanation based on scientific evidence, at most three sentences
 
             Focus on:
             - Scientific evidence from hazard knowledge
@@ -58,134 +185,163 @@ class RAGAnalysisAgent:
             Be precise and evidence-based in your analysis.
             """)
     
-    def load_hazard_data_from_docx(self, docx_path):
-        doc = docx.Document(docx_path)
-        full_text = []
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                full_text.append(paragraph.text)
-        
-        self.knowledge_base = "\n".join(full_text)
-        print(f" Document loaded: {len(self.knowledge_base)} characters")
-    
     def extract_diet_info(self, diet_keyword):
         if self.vector_store is None:
             return "Vector database not ready"
-        diet_queries = {
-            'celiac': "gluten wheat barley rye celiac disease autoimmune",
-            'diabetes': "sugar glucose fructose carbohydrates glycemic insulin",
-            'vegan': "vegan animal milk egg honey gelatin dairy",
-            'vegetarian': "vegetarian meat fish chicken poultry gelatin",
-            'lactose': "lactose milk dairy cheese whey intolerance",
-            'nut_allergy': "nut peanut almond walnut hazelnut allergy anaphylaxis",
-            'soy_allergy': "soy soybean tofu soybeans allergy",
-            'heart_disease': "saturated fat cholesterol sodium salt heart cardiovascular",
-            'hypertension': "sodium salt blood pressure hypertension",
-            'baby_0_6': "infant formula breast milk 0-6 months honey salt sugar",
-            'baby_6_8': "6-8 months puree salt sugar honey egg whites",
-            'baby_8_12': "8-12 months soft foods choking hazards salt sugar"
-        }
-        
-        if diet_keyword in diet_queries:
-            docs = self.vector_store.similarity_search(
-                diet_queries[diet_keyword], k=3)
+        if diet_keyword in DIET_QUERIES:
+            docs = self.hybrid_search(DIET_QUERIES[diet_keyword], k=3)
             relevant_info = "\n".join([doc.page_content for doc in docs])
             return relevant_info if relevant_info else "No relevant information found"
         return "Diet information not found"
     
     def analyze_with_llm(self, ingredients, diet):
+        # The model reads the label as printed; canonical ids only drive the hazard matrix lookup.
+        # Users scanning the same product at once share one LLM call
+        return self.llm_flight.do((normalize_text(ingredients), diet), self.run_llm_analysis, ingredients, diet)
+    
+    def run_llm_analysis(self, ingredients, diet):
         hazard_info = self.extract_diet_info(diet)
-        chain = LLMChain(llm=self.llm, prompt=self.analysis_prompt)
         try:
-            response = chain.run({
-                "ingredients": ingredients,
-                "diet": diet,
-                "hazard_info": hazard_info})
-            return self.parse_llm_response(response, diet)
+            prompt = self.analysis_prompt.format(ingredients=ingredients, diet=diet, hazard_info=hazard_info)
+            response = self.generate_analysis(prompt)
+            self.count_format('analyses')
+            try:
+                return self.parse_llm_response(response)
+            except ValueError as e:
+                self.count_format('invalid')
+                # One retry that tells the model what was wrong with its answer
+                repair_prompt = (f"{prompt}\n\nYour previous answer was rejected: {str(e)}.\n"
+                                 f"Previous answer: {response[:1000]}\n"
+                                 "Reply again with only the corrected JSON object.")
+                result = self.parse_llm_response(self.generate_analysis(repair_prompt))
+                self.count_format('repaired')
+                return result
         except Exception as e:
+            if isinstance(e, ValueError):
+                self.count_format('failed')
+            # No verdict: neither safe nor risky, and left out of the risk score
             return {
-                'suitable': False,
-                'risk_level': 'HIGH',
-                'explanation': f'LLM error: {str(e)}',
-                'hazardous_ingredients': ['Analysis error']
+                'suitable': None,
+                'risk_level': 'UNKNOWN',
+                'explanation': f'Analysis failed, please retry ({str(e)})',
+                'hazardous_ingredients': [],
+                'error': True
             }
     
-    def parse_llm_response(self, response, diet):
-        response_lower = response.lower()
-        suitable = False
-        risk_level = 'HIGH'
-        explanation = "Analysis incomplete"
-        hazardous_ingredients = []
-        if 'suitable: yes' in response_lower or 'suitable:yes' in response_lower:
-            suitable = True
-        elif 'suitable: no' in response_lower or 'suitable:no' in response_lower:
-            suitable = False
-        if 'risk_level: low' in response_lower:
-            risk_level = 'LOW'
-        elif 'risk_level: medium' in response_lower:
-            risk_level = 'MEDIUM'
-        elif 'risk_level: high' in response_lower:
-            risk_level = 'HIGH'
-        if 'hazardous_ingredients:' in response_lower:
-            start_idx = response_lower.find('hazardous_ingredients:') + len('hazardous_ingredients:')
-            end_idx = response_lower.find('explanation:', start_idx)
-            if end_idx == -1:
-                end_idx = len(response)
-            
-            ingredients_text = response[start_idx:end_idx].strip()
-            if 'none' not in ingredients_text.lower():
-                hazardous_ingredients = [ing.strip() for ing in ingredients_text.split(',') if ing.strip()]
-        
-        if 'explanation:' in response_lower:
-            start_idx = response_lower.find('explanation:') + len('explanation:')
-            explanation = response[start_idx:].strip()
-        
-        diet_hazards = {
-            'celiac': ['wheat', 'gluten', 'barley', 'rye', 'oats', 'malt'],
-            'diabetes': ['sugar', 'glucose', 'fructose', 'sucrose', 'syrup', 'honey'],
-            'vegan': ['milk', 'egg', 'honey', 'gelatin', 'cheese', 'yogurt'],
-            'vegetarian': ['meat', 'fish', 'chicken', 'beef', 'pork', 'gelatin'],
-            'lactose': ['milk', 'cheese', 'yogurt', 'whey', 'lactose', 'dairy'],
-            'nut_allergy': ['peanut', 'almond', 'walnut', 'hazelnut', 'cashew', 'pistachio'],
-            'soy_allergy': ['soy', 'soybean', 'tofu', 'soy lecithin', 'soy protein'],
-            'heart_disease': ['saturated fat', 'trans fat', 'cholesterol', 'sodium', 'salt'],
-            'hypertension': ['sodium', 'salt', 'msg', 'monosodium glutamate'],
-            'baby_0_6': ['honey', 'salt', 'sugar', 'cow milk'],
-            'baby_6_8': ['honey', 'salt', 'sugar', 'egg whites', 'nuts'],
-            'baby_8_12': ['honey', 'salt', 'sugar', 'choking hazards']
-        }
-        
-        if not hazardous_ingredients and diet in diet_hazards:
-            ingredients_lower = response_lower
-            for hazard in diet_hazards[diet]:
-                if hazard in ingredients_lower:
-                    hazardous_ingredients.append(hazard)
+    def generate_analysis(self, prompt):
+        response = self.models.generate(self.llm_model, prompt, format=ANALYSIS_SCHEMA,
+                                        options={'temperature': 0, 'num_predict': ANALYSIS_MAX_TOKENS})
+        with self.format_stats_lock:
+            self.format_stats['calls'] += 1
+            self.format_stats['eval_tokens'] += response.get('eval_count') or 0
+        return response['response']
+    
+    def count_format(self, outcome):
+        with self.format_stats_lock:
+            self.format_stats[outcome] += 1
+    
+    def parse_llm_response(self, response):
+        """Strict reading of a schema-bound answer; ValueError names what is wrong"""
+        try:
+            data = json.loads(response)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"not valid JSON ({e.msg})")
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        missing = [field for field in ANALYSIS_SCHEMA['required'] if field not in data]
+        if missing:
+            raise ValueError(f"missing fields: {', '.join(missing)}")
+        if not isinstance(data['suitable'], bool):
+            raise ValueError('"suitable" must be true or false')
+        risk_level = str(data['risk_level']).strip().upper()
+        if risk_level not in ('LOW', 'MEDIUM', 'HIGH'):
+            raise ValueError('"risk_level" must be "LOW", "MEDIUM" or "HIGH"')
+        hazards = data['hazardous_ingredients']
+        if not isinstance(hazards, list) or not all(isinstance(h, str) for h in hazards):
+            raise ValueError('"hazardous_ingredients" must be a list of strings')
+        if not isinstance(data['explanation'], str) or not data['explanation'].strip():
+            raise ValueError('"explanation" must be a non-empty string')
         
+        hazardous_ingredients = [h.strip() for h in hazards if h.strip() and h.strip().lower() != 'none']
         return {
-            'suitable': suitable,
+            'suitable': data['suitable'],
             'risk_level': risk_level,
-            'explanation': explanation,
+            'explanation': data['explanation'].strip(),
             'hazardous_ingredients': hazardous_ingredients if hazardous_ingredients else ['No hazardous ingredients detected']
         }
     
-    def analyze_ingredients(self, ingredients_text, user_preferences):
+    def get_format_stats(self):
+        with self.format_stats_lock:
+            stats = dict(self.format_stats)
+        analyses = stats['analyses']
+        stats['invalid_rate'] = stats['invalid'] / analyses if analyses else 0.0
+        stats['failure_rate'] = stats['failed'] / analyses if analyses else 0.0
+        stats['tokens_per_call'] = stats['eval_tokens'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+    
+    def analyze_ingredients(self, ingredients_text, user_preferences, progress=None):
         analysis_results = {}
+        verdicts, unseen = {}, []
+        if self.hazard_matrix is not None:
+            verdicts, unseen = self.hazard_matrix.lookup(ingredient_ids(ingredients_text), user_preferences)
         
         for preference in user_preferences:
-            result = self.analyze_with_llm(ingredients_text, preference)
+            verdict = verdicts.get(preference)
+            if verdict is None:
+                result = self.analyze_with_llm(ingredients_text, preference)
+            elif unseen:
+                # Only the ingredients missing from the matrix need the LLM
+                unseen_text = ", ".join(display_name(ingredient) for ingredient in unseen)
+                result = merge_results(verdict_to_result(verdict, preference),
+                                       self.analyze_with_llm(unseen_text, preference))
+            else:
+                result = verdict_to_result(verdict, preference)
             analysis_results[preference] = result
+            if progress:
+                progress('analysis', preference)
         
         return analysis_results
     
     def calculate_risk_score(self, analysis_results):
-        total_preferences = len(analysis_results)
+        # Diets whose analysis failed have no verdict and are not counted either way
+        scored = [result for result in analysis_results.values() if not result.get('error')]
+        total_preferences = len(scored)
         if total_preferences == 0:
             return 0
         
-        safe_preferences = sum(1 for result in analysis_results.values() if result['suitable'])
+        safe_preferences = sum(1 for result in scored if result['suitable'])
         return (safe_preferences / total_preferences) * 100
 
+    def batch_similarity_search(self, queries, k=2):
+        """Embed all queries in one encoder pass and run a single FAISS search"""
+        if self.vector_store is None or not queries:
+            return []
+        queries = list(queries)
+        vectors = np.array(self.embeddings.embed_queries(queries), dtype=np.float32)
+        scores, indices = self.vector_store.index.search(vectors, k)
+        
+        # Keep each passage once, under the query it matched best (L2: lower is closer)
+        best = {}
+        for query, query_scores, query_indices in zip(queries, scores, indices):
+            for score, idx in zip(query_scores, query_indices):
+                if idx == -1:
+                    continue
+                if idx not in best or score < best[idx][0]:
+                    best[idx] = (float(score), query)
+        
+        results = []
+        seen_content = set()
+        for idx, (score, query) in sorted(best.items(), key=lambda item: item[1][0]):
+            doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[idx])
+            if doc.page_content in seen_content:
+                continue
+            seen_content.add(doc.page_content)
+            results.append({'query': query, 'content': doc.page_content, 'score': score})
+        return results
+
+    def get_embedding_cache_stats(self):
+        return self.embedding_cache.stats()
+
     def search_similar_products(self, query, k=3):
         if self.vector_store:
             docs = self.vector_store.similarity_search(query, k=k)
@@ -195,7 +351,7 @@ class RAGAnalysisAgent:
     def get_scientific_evidence(self, ingredient, diet):
         try:
             query = f"{ingredient} {diet} health effects scientific research"
-            docs = self.vector_store.similarity_search(query, k=2)
+            docs = self.hybrid_search(query, k=2)
             evidence = "\n".join([doc.page_content for doc in docs])
             return evidence if evidence else "No specific scientific evidence found"
         except:
@@ -235,7 +391,7 @@ if __name__ == "__main__":
     
     for diet, analysis in results.items():
         print(f"\n{diet.upper()}:")
-        print(f"  Suitable: {'Yes' if analysis['suitable'] else 'No'}")
+        print(f"  Suitable: {'Unknown' if analysis.get('error') else 'Yes' if analysis['suitable'] else 'No'}")
         print(f"  Risk Level: {analysis['risk_level']}")
         print(f"  Explanation: {analysis['explanation']}")
         if analysis['hazardous_ingredients']:
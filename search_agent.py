@@ -7,12 +7,22 @@ Created on Sat Oct 25 04:07:41 2025
 
 # search_agent.py
 import requests
+from ingredient_parser import normalize_text
+from singleflight import get_flight
 
 class SearchAgent:
     def __init__(self):
         self.base_url = "https://world.openfoodfacts.org/api/v0/product"
+        self.search_flight = get_flight("search_product")
+        self.barcode_flight = get_flight("search_by_barcode")
+        # (connect, read) seconds; a stalled OpenFoodFacts request must not hold up the scan
+        self.timeout = (3.05, 10)
     
     def search_product(self, brand_name):
+        # "Ülker", "ULKER " and "ülker" are the same OpenFoodFacts query
+        return self.search_flight.do(normalize_text(brand_name), self.run_search, brand_name)
+    
+    def run_search(self, brand_name):
         try:
             search_url = "https://world.openfoodfacts.org/cgi/search.pl"
             params = {
@@ -22,17 +32,33 @@ class SearchAgent:
                 'page_size': 1
             }
             
-            response = requests.get(search_url, params=params)
+            response = requests.get(search_url, params=params, timeout=self.timeout)
             data = response.json()
             
             if data['products']:
-                product = data['products'][0]
-                return {
-                    'product_name': product.get('product_name', 'Bilinmiyor'),
-                    'brand': product.get('brands', 'Bilinmiyor'),
-                    'ingredients': product.get('ingredients_text', 'Bilinmiyor')
-                }
+                return self.format_product(data['products'][0])
             return {"error": "Ürün bulunamadı"}
                 
         except Exception as e:
-            return {"error": f"Arama hatası: {str(e)}"}
\ No newline at end of file
+            return {"error": f"Arama hatası: {str(e)}"}
+    
+    def search_by_barcode(self, barcode):
+        return self.barcode_flight.do(barcode.strip(), self.run_barcode_search, barcode.strip())
+    
+    def run_barcode_search(self, barcode):
+        try:
+            response = requests.get(f"{self.base_url}/{barcode}.json", timeout=self.timeout)
+            data = response.json()
+            if data.get('status') == 1:
+                return self.format_product(data['product'])
+            return {"error": "Ürün bulunamadı"}
+        
+        except Exception as e:
+            return {"error": f"Arama hatası: {str(e)}"}
+    
+    def format_product(self, product):
+        return {
+            'product_name': product.get('product_name', 'Bilinmiyor'),
+            'brand': product.get('brands', 'Bilinmiyor'),
+            'ingredients': product.get('ingredients_text', 'Bilinmiyor')
+        }
\ No newline at end of file
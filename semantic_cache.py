@@ -0,0 +1,91 @@
+# semantic_cache.py
+# Answers to near-duplicate questions ("Can I give egg to my 6-month-old baby?" /
+# "can my 6 month old baby eat eggs") are reused when the asker's profile signature matches.
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from ingredient_parser import ingredient_ids, mentioned_ids
+
+
+def profile_signature(*parts):
+    """Compact, order-independent key of the personalization context an answer depends on"""
+    normalized = []
+    for part in parts:
+        if isinstance(part, (list, tuple, set, frozenset)):
+            part = ",".join(sorted(str(p).lower() for p in part))
+        normalized.append("" if part is None else str(part).lower())
+    return "|".join(normalized)
+
+
+def food_signature(message, ingredients=None):
+    """Foods the question is about, whether or not it is phrased as an ingredient list"""
+    return sorted(mentioned_ids(message) | ingredient_ids(ingredients or ""))
+
+
+class SemanticCache:
+    def __init__(self, embed, threshold=0.9, ttl=6 * 3600, max_entries=2000):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # id -> (signature, unit vector, answer, created)
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def vector(self, question):
+        vector = np.asarray(self.embed(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, question, signature, vector=None):
+        """Returns (answer or None, question vector); pass the vector back to store()"""
+        vector = self.vector(question) if vector is None else vector
+        now = time.time()
+        with self.lock:
+            expired = [entry_id for entry_id, entry in self.entries.items() if now - entry[3] > self.ttl]
+            for entry_id in expired:
+                del self.entries[entry_id]
+            candidates = [(entry_id, entry) for entry_id, entry in self.entries.items() if entry[0] == signature]
+            if candidates:
+                similarities = np.stack([entry[1] for _, entry in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self.entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry[2], vector
+            self.misses += 1
+        return None, vector
+
+    def store(self, question, signature, answer, vector=None):
+        vector = self.vector(question) if vector is None else vector
+        with self.lock:
+            self.entries[self.next_id] = (signature, vector, answer, time.time())
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+if __name__ == "__main__":
+    # Worst case for the embedding: every question gets the same vector, so only the
+    # signature keeps answers about different foods apart
+    cache = SemanticCache(lambda question: [1.0, 0.0])
+    honey = "Can I give honey to my 6-month-old?"
+    egg = "Can I give egg to my 6-month-old?"
+    cache.store(egg, profile_signature(food_signature(egg), 6), "Egg is fine from 6 months.")
+    assert food_signature(honey) == ['honey'] and food_signature(egg) == ['egg']
+    assert cache.lookup(honey, profile_signature(food_signature(honey), 6))[0] is None
+    assert cache.lookup("can my 6 month old eat egg", profile_signature(food_signature(egg), 6))[0]
+    print("Questions about different foods never share a cached answer:", cache.get_stats())
@@ -0,0 +1,191 @@
+# session_store.py
+# Per-user state (profiles, chat histories) behind lock-striped shards. The default backend
+# keeps it in this process; SQLite or Redis let several app processes share it.
+#
+#   NUTRIVERSE_SESSION_STORE=sqlite:///nutriverse_sessions.db
+#   NUTRIVERSE_SESSION_STORE=redis://localhost:6379/0
+#
+# Unset, it is in-memory unless WEB_CONCURRENCY asks for several workers, which then
+# share DEFAULT_SQLITE_PATH instead of each keeping a different part of every user's state.
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager, nullcontext
+
+DEFAULT_SQLITE_PATH = "nutriverse_sessions.db"
+
+
+class MemoryBackend:
+    """Values are kept as live objects, so in-place changes are visible without a write"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, namespace, key):
+        return self.data.get((namespace, key))
+
+    def set(self, namespace, key, value):
+        self.data[(namespace, key)] = value
+
+    def delete(self, namespace, key):
+        self.data.pop((namespace, key), None)
+
+    def items(self, namespace):
+        return [(key, value) for (ns, key), value in list(self.data.items()) if ns == namespace]
+
+    def lock(self, namespace, key):
+        # The shard lock is enough inside one process
+        return nullcontext()
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.connection().execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )""")
+
+    def connection(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.conn.execute("PRAGMA journal_mode=WAL")
+            self.local.depth = 0
+        return self.local.conn
+
+    def get(self, namespace, key):
+        row = self.connection().execute("SELECT value FROM sessions WHERE namespace = ? AND key = ?",
+                                        (namespace, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace, key, value):
+        self.connection().execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                                  (namespace, key, json.dumps(value, ensure_ascii=False)))
+
+    def delete(self, namespace, key):
+        self.connection().execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace):
+        rows = self.connection().execute("SELECT key, value FROM sessions WHERE namespace = ?", (namespace,))
+        return [(key, json.loads(value)) for key, value in rows.fetchall()]
+
+    @contextmanager
+    def lock(self, namespace, key):
+        # A write transaction serializes read-modify-write across processes
+        conn = self.connection()
+        if self.local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self.local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            conn.execute("COMMIT")
+
+
+class RedisBackend:
+    """Any Redis-protocol server (Redis, Valkey, KeyDB)"""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, namespace, key):
+        value = self.client.get(f"{namespace}:{key}")
+        return json.loads(value) if value else None
+
+    def set(self, namespace, key, value):
+        self.client.set(f"{namespace}:{key}", json.dumps(value, ensure_ascii=False))
+
+    def delete(self, namespace, key):
+        self.client.delete(f"{namespace}:{key}")
+
+    def items(self, namespace):
+        keys = [k for k in self.client.scan_iter(f"{namespace}:*") if not k.endswith(b":lock")]
+        values = self.client.mget(keys) if keys else []
+        return [(k.decode()[len(namespace) + 1:], json.loads(v)) for k, v in zip(keys, values) if v]
+
+    def lock(self, namespace, key):
+        return self.client.lock(f"{namespace}:{key}:lock", timeout=30, blocking_timeout=30)
+
+
+class SessionStore:
+    """user_id -> JSON-serializable value; users hash to shards that each have their own lock"""
+
+    def __init__(self, namespace, backend=None, shards=32):
+        self.namespace = namespace
+        self.backend = backend or MemoryBackend()
+        self.locks = [threading.RLock() for _ in range(shards)]
+
+    @contextmanager
+    def lock(self, user_id):
+        with self.locks[zlib.crc32(str(user_id).encode()) % len(self.locks)]:
+            with self.backend.lock(self.namespace, str(user_id)):
+                yield
+
+    def get(self, user_id, default=None):
+        value = self.backend.get(self.namespace, str(user_id))
+        return default if value is None else value
+
+    def set(self, user_id, value):
+        with self.lock(user_id):
+            self.backend.set(self.namespace, str(user_id), value)
+
+    def delete(self, user_id):
+        with self.lock(user_id):
+            self.backend.delete(self.namespace, str(user_id))
+
+    @contextmanager
+    def edit(self, user_id, default_factory=dict):
+        """Read-modify-write of one user's value, atomic against other threads and processes"""
+        with self.lock(user_id):
+            value = self.backend.get(self.namespace, str(user_id))
+            if value is None:
+                value = default_factory()
+            yield value
+            self.backend.set(self.namespace, str(user_id), value)
+
+    def items(self):
+        return self.backend.items(self.namespace)
+
+    def __contains__(self, user_id):
+        return self.backend.get(self.namespace, str(user_id)) is not None
+
+
+shared_backend = None
+shared_backend_lock = threading.Lock()
+
+
+def is_process_local():
+    """True when session state lives only in this process"""
+    with shared_backend_lock:
+        return isinstance(shared_backend, MemoryBackend)
+
+
+def make_session_store(namespace, shards=32):
+    """Store on the backend named by NUTRIVERSE_SESSION_STORE, shared by all stores of the process"""
+    global shared_backend
+    with shared_backend_lock:
+        if shared_backend is None:
+            url = os.environ.get("NUTRIVERSE_SESSION_STORE", "")
+            if not url and int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+                url = f"sqlite:///{DEFAULT_SQLITE_PATH}"
+                print(f"WEB_CONCURRENCY > 1 and NUTRIVERSE_SESSION_STORE unset: sharing sessions in {DEFAULT_SQLITE_PATH}")
+            if url.startswith("sqlite:///"):
+                shared_backend = SQLiteBackend(url[len("sqlite:///"):])
+            elif url.startswith("redis://") or url.startswith("rediss://"):
+                shared_backend = RedisBackend(url)
+            else:
+                shared_backend = MemoryBackend()
+    return SessionStore(namespace, shared_backend, shards)
@@ -0,0 +1,128 @@
+# singleflight.py
+# Concurrent calls with the same key share one execution: the first caller runs it,
+# the others wait on its future and get a copy of the same result.
+import copy
+import threading
+from concurrent.futures import Future
+
+FLIGHTS = {}
+FLIGHTS_LOCK = threading.Lock()
+
+
+class ProgressRelay:
+    """Forwards the leader's progress(stage, detail) events to every caller that joined it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.events = []
+
+    def add(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            events = list(self.events)
+        # A late joiner first catches up on what already happened
+        for event in events:
+            self.notify(listener, event)
+
+    def remove(self, listener):
+        with self.lock:
+            self.listeners.remove(listener)
+
+    def reset(self):
+        with self.lock:
+            self.events = []
+
+    def __call__(self, stage, detail=None):
+        with self.lock:
+            self.events.append((stage, detail))
+            listeners = list(self.listeners)
+        for listener in listeners:
+            self.notify(listener, (stage, detail))
+
+    def notify(self, listener, event):
+        try:
+            listener(*event)
+        except Exception as e:
+            print(f"Progress callback failed: {str(e)}")
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.relays = {}    # key -> [ProgressRelay, callers using it]
+        self.stats = {'calls': 0, 'executed': 0, 'coalesced': 0, 'errors': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            self.stats['calls'] += 1
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # Results are dicts the callers may modify, so followers get their own copy
+            return copy.deepcopy(future.result())
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            with self.lock:
+                self.stats['errors'] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def do_with_progress(self, key, progress, fn, *args):
+        """Like do(), for fn(*args, progress): every caller's progress hears the shared run's events"""
+        with self.lock:
+            entry = self.relays.setdefault(key, [ProgressRelay(), 0])
+            entry[1] += 1
+        relay = entry[0]
+        if progress:
+            relay.add(progress)
+        try:
+            return self.do(key, self.run_relayed, relay, fn, *args)
+        finally:
+            if progress:
+                relay.remove(progress)
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.relays[key]
+
+    def run_relayed(self, relay, fn, *args):
+        # Events of an earlier run under the same key must not be replayed to this one's joiners
+        relay.reset()
+        return fn(*args, relay)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['coalesced_rate'] = stats['coalesced'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+
+
+def get_flight(name):
+    """One SingleFlight per name per process, so metrics can be read from one place"""
+    with FLIGHTS_LOCK:
+        if name not in FLIGHTS:
+            FLIGHTS[name] = SingleFlight(name)
+        return FLIGHTS[name]
+
+
+def coalescing_stats():
+    with FLIGHTS_LOCK:
+        flights = list(FLIGHTS.values())
+    return {flight.name: flight.get_stats() for flight in flights}
@@ -7,24 +7,48 @@ Created on Sat Oct 25 17:00:26 2025
 
 
 # vision_agent.py
-import ollama
 from PIL import Image
 import base64
+import hashlib
 import io
 import os
+import re
+import threading
+from collections import OrderedDict
+from model_manager import get_model_manager
+
+# Words that open the ingredient panel on labels sold in the markets we see
+INGREDIENT_MARKERS = re.compile(r'^(ingredients?|ingrédients|zutaten|içindekiler|contains)\b', re.IGNORECASE)
+# Lines that start the next section of the label (nutrition table, storage, producer)
+PANEL_END_HEADERS = re.compile(r'^(nutrition|nutritional|energy|per|typical|average|besin|enerji|nährwert|'
+                               r'durchschnittliche|valeurs|storage|store|keep|best|produced|manufactured|'
+                               r'üretici|saklama|tavsiye|allergy|allergen)\b', re.IGNORECASE)
+# Mean Tesseract word confidence (0-1) below which the panel is read again with llava
+OCR_MIN_CONFIDENCE = 0.8
+# An ingredient list shorter than this is more likely a misread than a real panel
+OCR_MIN_LENGTH = 10
 
 class VisionAgent:
-    def __init__(self, model_name='llava:7b'):
+    def __init__(self, model_name='llava:7b', model_manager=None):
         self.model_name = model_name
+        self.models = model_manager or get_model_manager()
+        # Ingredient panels by image hash; chat users often send the same photo again
+        self.ingredient_cache = OrderedDict()
+        self.ingredient_cache_size = 256
+        self.cache_lock = threading.Lock()
+        self.stats = {'ocr': 0, 'llava': 0, 'failed': 0, 'cache_hits': 0, 'cache_misses': 0}
+    
+    def encode_image(self, image_path):
+        with Image.open(image_path) as img:
+            buffered = io.BytesIO()
+            img.convert('RGB').save(buffered, format="JPEG")
+            return base64.b64encode(buffered.getvalue()).decode()
     
     def detect_brand(self, image_path):
         try:
-            with Image.open(image_path) as img:
-                buffered = io.BytesIO()
-                img.save(buffered, format="JPEG")
-                img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            response = ollama.chat(
-                model=self.model_name,
+            img_base64 = self.encode_image(image_path)
+            response = self.models.chat(
+                self.model_name,
                 messages=[{
                     'role': 'user',
                     'content': 'WHAT IS THE BRAND NAME IN THIS PRODUCT? ANSWER ONLY WITH THE BRAND NAME.',
@@ -33,4 +57,144 @@ class VisionAgent:
             return brand
             
         except Exception as e:
-            return f"Hata: {str(e)}"
\ No newline at end of file
+            return f"Hata: {str(e)}"
+    
+    def read_barcodes(self, image_path):
+        """EAN/UPC codes on the package; needs pyzbar, otherwise returns []"""
+        try:
+            from pyzbar.pyzbar import decode
+            with Image.open(image_path) as img:
+                return [code.data.decode('ascii') for code in decode(img) if code.data]
+        except Exception:
+            return []
+    
+    def ocr_brand_candidates(self, image_path, max_candidates=3):
+        """Largest confidently read text lines, which on a package front are usually the brand"""
+        try:
+            import pytesseract
+            with Image.open(image_path) as img:
+                data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+        except Exception:
+            return []
+        
+        lines = {}
+        for i, word in enumerate(data['text']):
+            if word.strip() and float(data['conf'][i]) > 60:
+                key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+                line = lines.setdefault(key, {'words': [], 'height': 0})
+                line['words'].append(word.strip())
+                line['height'] = max(line['height'], data['height'][i])
+        
+        candidates = []
+        for line in sorted(lines.values(), key=lambda l: l['height'], reverse=True):
+            text = " ".join(line['words'])
+            if len(text) >= 3 and any(c.isalpha() for c in text) and text not in candidates:
+                candidates.append(text)
+        return candidates[:max_candidates]
+    
+    def extract_ingredients(self, image_path):
+        """Ingredient list on the package: Tesseract first, llava when OCR is missing or unsure.
+        Returns {'success', 'ingredients', 'source', 'confidence'}"""
+        with open(image_path, 'rb') as f:
+            image_hash = hashlib.sha256(f.read()).hexdigest()
+        with self.cache_lock:
+            if image_hash in self.ingredient_cache:
+                self.ingredient_cache.move_to_end(image_hash)
+                self.stats['cache_hits'] += 1
+                return dict(self.ingredient_cache[image_hash])
+            self.stats['cache_misses'] += 1
+        
+        ingredients, confidence = self.ocr_ingredient_panel(image_path)
+        if ingredients and confidence >= OCR_MIN_CONFIDENCE and len(ingredients) >= OCR_MIN_LENGTH:
+            result = {'success': True, 'ingredients': ingredients, 'source': 'ocr', 'confidence': confidence}
+        else:
+            result = self.read_ingredients_with_llava(image_path)
+        if result is None:
+            # llava failed; a later retry may succeed, so nothing is cached
+            with self.cache_lock:
+                self.stats['failed'] += 1
+            return {'success': False, 'ingredients': None, 'source': 'llava', 'confidence': 0.0,
+                    'message': "The ingredient list could not be read"}
+        
+        with self.cache_lock:
+            self.stats[result['source']] += 1
+            self.ingredient_cache[image_hash] = result
+            while len(self.ingredient_cache) > self.ingredient_cache_size:
+                self.ingredient_cache.popitem(last=False)
+        return dict(result)
+    
+    def ocr_ingredient_panel(self, image_path):
+        """(text after the ingredient marker up to the end of its sentence, mean confidence 0-1)"""
+        try:
+            import pytesseract
+            with Image.open(image_path) as img:
+                gray = img.convert('L')
+                # Label print is small; Tesseract reads it better at roughly 300 dpi
+                if gray.width < 1500:
+                    gray = gray.resize((gray.width * 2, gray.height * 2), Image.LANCZOS)
+                data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
+        except Exception:
+            return None, 0.0
+        
+        words = [{'text': data['text'][i].strip(), 'conf': float(data['conf'][i]), 'top': data['top'][i],
+                  'height': data['height'][i],
+                  'block': (data['block_num'][i], data['par_num'][i]),
+                  'line': (data['block_num'][i], data['par_num'][i], data['line_num'][i])}
+                 for i in range(len(data['text'])) if data['text'][i].strip() and float(data['conf'][i]) >= 0]
+        start = next((i for i, word in enumerate(words) if INGREDIENT_MARKERS.match(word['text'])), None)
+        if start is None:
+            return None, 0.0
+        
+        panel = []
+        first = INGREDIENT_MARKERS.sub('', words[start]['text']).lstrip(' :;')
+        if first:
+            panel.append((first, words[start]['conf']))
+        previous = words[start]
+        for word in words[start + 1:]:
+            if word['line'] != previous['line'] and self.panel_ends(previous, word):
+                break
+            panel.append((word['text'], word['conf']))
+            previous = word
+            if word['text'].endswith('.') and not re.search(r'\d\.$', word['text']):
+                break
+        if not panel:
+            return None, 0.0
+        text = " ".join(word for word, _ in panel).lstrip(' :;').rstrip('.')
+        return text, sum(conf for _, conf in panel) / len(panel) / 100
+    
+    def panel_ends(self, previous, word):
+        """Whether a new line no longer belongs to the ingredient list that ended with previous"""
+        # Tesseract starts a new block or paragraph at a blank line or a layout break
+        if word['block'] != previous['block']:
+            return True
+        if PANEL_END_HEADERS.match(word['text']):
+            return True
+        # A gap of more than a line's height between lines separates panels
+        gap = word['top'] - (previous['top'] + previous['height'])
+        return gap > max(previous['height'], word['height'])
+    
+    def read_ingredients_with_llava(self, image_path):
+        try:
+            response = self.models.chat(
+                self.model_name,
+                messages=[{
+                    'role': 'user',
+                    'content': 'READ THE INGREDIENT LIST ON THIS PRODUCT. ANSWER ONLY WITH THE INGREDIENTS, '
+                               'COMMA SEPARATED. IF NO INGREDIENT LIST IS VISIBLE, ANSWER NONE.',
+                    'images': [self.encode_image(image_path)]}])
+        except Exception as e:
+            print(f"llava ingredient reading failed: {str(e)}")
+            return None
+        text = response['message']['content'].strip()
+        if not text or text.upper().startswith('NONE'):
+            return {'success': False, 'ingredients': None, 'source': 'llava', 'confidence': 0.0,
+                    'message': "No ingredient list is visible in the photo"}
+        return {'success': True, 'ingredients': text, 'source': 'llava', 'confidence': None}
+    
+    def get_stats(self):
+        with self.cache_lock:
+            lookups = self.stats['cache_hits'] + self.stats['cache_misses']
+            reads = self.stats['ocr'] + self.stats['llava']
+            return dict(self.stats, cached_images=len(self.ingredient_cache),
+                        cache_hit_rate=self.stats['cache_hits'] / lookups if lookups else 0.0,
+                        ocr_rate=self.stats['ocr'] / reads if reads else 0.0)